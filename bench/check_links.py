@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import async_surveys  # noqa: E402
+import surveys  # noqa: E402
+import test  # noqa: E402
+from bench.server import DAAC_PATH, LOWERCASE_DAAC_PATH, PUBLIC_WEB_PATH, StandInServer  # noqa: E402
+from fetch import Fetcher  # noqa: E402
+from state import facid_from_link  # noqa: E402
+from store import SqliteStore  # noqa: E402
+
+# Usage: python -m bench.check_links
+# Crawls bench.server with each scraper from a month whose index links with lowercase
+# facid=...&page=1, read ahead of the usual Facid=...&PAGE=1 month. dedupe_by_facid keeps the
+# lowercase links, so this checks every discovered facility still gets through scrape_pages
+# and into the store (surveys.py only keeps the Medicare rows of the index). Exits 1 if any
+# facility is missing.
+
+
+def run_sync(site, store):
+    client = surveys.create_session()
+    fetcher = Fetcher(attempts=2)
+    base_url = f'{site}{PUBLIC_WEB_PATH}'
+    endpoints = surveys.discover_endpoints([f'{site}{LOWERCASE_DAAC_PATH}', f'{site}{DAAC_PATH}'], {},
+                                           fetcher=fetcher, base_url=base_url, client=client)
+    surveys.run_app(endpoints, {}, None, None, store=store, base_url=base_url, fetcher=fetcher, client=client)
+    client.close()
+    return endpoints
+
+
+def run_async(module):
+    def run(site, store):
+        async def crawl():
+            base_url = f'{site}{PUBLIC_WEB_PATH}'
+            async with module.create_client() as client:
+                fetcher = Fetcher(attempts=2)
+                endpoints = await module.discover_endpoints(client, [f'{site}{LOWERCASE_DAAC_PATH}',
+                                                                     f'{site}{DAAC_PATH}'], {},
+                                                            fetcher=fetcher, base_url=base_url)
+                await module.crawl(client, endpoints, {}, store=store, base_url=base_url, fetcher=fetcher)
+            return endpoints
+        return asyncio.run(crawl())
+    return run
+
+
+SCRAPERS = {
+    'surveys.py': run_sync,
+    'async_surveys.py': run_async(async_surveys),
+    'test.py': run_async(test),
+}
+
+
+def main():
+    server = StandInServer(('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, run in SCRAPERS.items():
+            store = SqliteStore(os.path.join(workdir, f'{name}.sqlite'))
+            endpoints = run(server.url, store)
+            expected = {facid_from_link(link).lower() for link in endpoints}
+            written = {record['facid'].lower() for record in store.iter_surveys()}
+            store.close()
+            lowercase = sum('facid=' in link for link in endpoints)
+            missing = sorted(expected - written)
+            print(f'{name:<18}{lowercase} of {len(endpoints)} links lowercase, '
+                  f'{len(written)} of {len(expected)} facilities written'
+                  + (f', missing {", ".join(missing)}' if missing else ''))
+            failed = failed or bool(missing) or not endpoints
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import glob
+import json
+import os
+import re
+from html import escape
+
+# The live site is not reachable from CI, so these pages are rebuilt from the scraped
+# archive in json/reviewed. They follow the layout the scrapers rely on: a
+# content-container table on the DAAC index, <font size="+1"> + <select id="SurveyList">
+# on the facility page, and five layout tables ahead of the deficiency tables (plus a
+# footer table) on each eventid page.
+
+BASE_URL = 'https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/'
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+ARCHIVE_GLOB = os.path.join(os.path.dirname(BENCH_DIR), 'json', 'reviewed', '20240323_survey_*.json')
+
+# Facids of the facilities in the 20240323 archive, paired with its files in sorted order
+FACIDS = ['750301', '27171500', '061901', '195601', '120801', '22701501', '53020100', '24230101']
+
+DEFICIENCY_START = re.compile(
+    r'(?:^| )(Initial comments:|\d{1,3}\.\d+[a-z]? ?(?:\([a-z0-9]+\))* [A-Z]{4,}[^:]{0,80}:)')
+
+
+def split_deficiencies(blob):
+    # Each deficiency appears twice in the flattened text; keep the first copy of each
+    starts = [m.start(1) for m in DEFICIENCY_START.finditer(blob)]
+    seen = set()
+    deficiencies = []
+    for start, end in zip(starts, starts[1:] + [len(blob)]):
+        segment = blob[start:end].strip()
+        key = re.sub(r'\s', '', segment)
+        if key in seen:
+            continue
+        seen.add(key)
+        header = DEFICIENCY_START.match(segment).group(1)
+        body = segment[len(header):]
+        left, marker, plan = body.partition('Plan of Correction')
+        regulation, _, observations = left.partition('Observations:')
+        deficiencies.append({
+            'header': header,
+            'regulation': regulation.strip('\xa0 '),
+            'observations': observations.strip('\xa0 '),
+            'plan': (marker + plan).strip(),
+        })
+    return deficiencies
+
+
+def render_index(facilities, base_url=BASE_URL, lowercase=False):
+    # lowercase links with facid=...&page=1, as some of the posted lists do
+    rows = ['<tr><th>Facility Name</th><th>County</th><th>Date Posted</th><th>Survey Category</th></tr>']
+    categories = ['Medicare', 'State Licensure', 'Complaint', 'Medicare/State']
+    for i, (facid, name) in enumerate(facilities):
+        if lowercase:
+            href = f'{base_url}ltc-survey.asp?facid={facid}&page=1&SurveyType=H'
+        else:
+            href = f'{base_url}ltc-survey.asp?Facid={facid}&PAGE=1&SurveyType=H'
+        rows.append(f'<tr><td><a href="{escape(href)}">{escape(name)}</a></td><td>PA</td>'
+                    f'<td>3/1/2024</td><td>{categories[i % len(categories)]}</td></tr>')
+    return ('<html><head><title>Surveys Posted</title></head><body>\n'
+            '<div class="header"><table><tr><td>Pennsylvania Department of Health</td></tr></table></div>\n'
+            '<div class="content-container">\n<h2>Surveys Posted</h2>\n<table class="surveys">\n'
+            + '\n'.join(rows) + '\n</table>\n</div>\n</body></html>\n')
+
+
+def render_facility(facid, name, surveys):
+    options = ['<option value="">-- Select a Survey --</option>']
+    options += [f'<option value="{escape(s["eventid"])}">{escape(s["date"])}</option>' for s in surveys]
+    return (f'<html><head><title>{escape(name)}</title></head><body>\n'
+            '<table width="100%"><tr><td><img src="/images/doh_logo.gif"></td>'
+            '<td>Pennsylvania Department of Health</td></tr></table>\n'
+            f'<table><tr><td><font size="+1">{escape(name)}<br>FACILITY ID {facid}</font></td></tr></table>\n'
+            f'<form name="SurveyForm" method="post" action="ltc-survey.asp?Facid={facid}&amp;PAGE=1&amp;SurveyType=H">\n'
+            '<input type="hidden" name="csrf_token" value="{00000000-0000-0000-0000-000000000000}">\n'
+            '<select name="SurveyList" id="SurveyList">\n' + '\n'.join(options) + '\n</select>\n</form>\n'
+            '<table><tr><td>Department of Health | Health Care Facilities</td></tr></table>\n'
+            '</body></html>\n')
+
+
+def render_deficiency(deficiency):
+    left = f'<b>{escape(deficiency["header"])}</b>{escape(deficiency["regulation"])}'
+    if deficiency['observations']:
+        left += f'<br><b>Observations:</b>{escape(deficiency["observations"])}'
+    return ('<table width="100%" border="1"><tr>'
+            f'<td valign="top" width="50%">{left}&nbsp;</td>'
+            f'<td valign="top" width="50%">{escape(deficiency["plan"])}</td>'
+            '</tr></table>')
+
+
+def render_survey(facid, name, survey):
+    deficiencies = split_deficiencies(survey.get('data', ''))
+    return (f'<html><head><title>{escape(name)}</title></head><body>\n'
+            '<table width="100%"><tr><td>Pennsylvania Department of Health</td></tr></table>\n'
+            f'<table><tr><td><font size="+1">{escape(name)}</font></td></tr></table>\n'
+            '<table><tr><td><a href="javascript:history.back()">Back</a></td></tr></table>\n'
+            f'<table><tr><td>Facility ID: {facid}</td><td>Event ID: {escape(survey["eventid"])}</td>'
+            f'<td>Survey Date: {escape(survey["date"])}</td></tr></table>\n'
+            '<table><tr><th>Deficiency</th><th>Plan of Correction</th></tr></table>\n'
+            + '\n'.join(render_deficiency(d) for d in deficiencies) + '\n'
+            '<table><tr><td>Department of Health | Health Care Facilities</td></tr></table>\n'
+            '</body></html>\n')
+
+
+def load_archive():
+    # [(facid, facility name, [survey dicts])] for the fixture facilities
+    facilities = []
+    for facid, path in zip(FACIDS, sorted(glob.glob(ARCHIVE_GLOB))):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        facilities.append((facid, data['facility'], data['data']))
+    return facilities
+
+
+def write_fixtures():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    facilities = load_archive()
+
+    def write(name, html):
+        with open(os.path.join(FIXTURE_DIR, name), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+    write('daac_index.html', render_index([(facid, name) for facid, name, _ in facilities]))
+    # A long-history facility and a short one, plus a large, a small and an empty survey page
+    for facid, name, surveys in facilities:
+        if name.startswith(('LANCASTER GENERAL', 'FULTON COUNTY')):
+            write(f'facility_{facid}.html', render_facility(facid, name, surveys))
+    for facid, name, surveys in facilities:
+        for survey in surveys:
+            if survey['eventid'] in ('45NQ11', '6UH811', 'S95Q11', 'ERR611'):
+                write(f'survey_{facid}_{survey["eventid"]}.html', render_survey(facid, name, survey))
+
+
+if __name__ == '__main__':
+    write_fixtures()
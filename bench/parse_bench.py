@@ -0,0 +1,69 @@
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import BACKENDS, HAVE_LXML, parse_facility_page, parse_index_links, parse_survey_page  # noqa: E402
+from bench.fixtures import FIXTURE_DIR  # noqa: E402
+
+# Usage: python -m bench.parse_bench [repeats]
+# Checks every backend produces the same output as 'html.parser' on the fixtures, then
+# reports the mean parse cost per page for each backend and page kind.
+
+EXTRACTORS = {
+    'daac_index': lambda content, backend: parse_index_links(content, lambda text: 'm' in text.lower(), backend),
+    'facility': parse_facility_page,
+    'survey': parse_survey_page,
+}
+
+
+def load_pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+        kind = os.path.basename(path).split('_')[0]
+        kind = 'daac_index' if kind == 'daac' else kind
+        with open(path, 'rb') as f:
+            pages.append((kind, os.path.basename(path), f.read()))
+    return pages
+
+
+def check_identical(pages, backends):
+    mismatches = 0
+    for kind, name, content in pages:
+        expected = EXTRACTORS[kind](content, 'html.parser')
+        for backend in backends:
+            if EXTRACTORS[kind](content, backend) != expected:
+                print(f'MISMATCH {backend} on {name}')
+                mismatches += 1
+    return mismatches
+
+
+def time_backend(pages, backend, repeats):
+    per_kind = {}
+    for kind, _, content in pages:
+        extract = EXTRACTORS[kind]
+        start = time.perf_counter()
+        for _ in range(repeats):
+            extract(content, backend)
+        elapsed = (time.perf_counter() - start) / repeats
+        total, count = per_kind.get(kind, (0.0, 0))
+        per_kind[kind] = (total + elapsed, count + 1)
+    return {kind: total / count for kind, (total, count) in per_kind.items()}
+
+
+def main(repeats=50):
+    backends = [b for b in BACKENDS if b != 'lxml' or HAVE_LXML]
+    pages = load_pages()
+    mismatches = check_identical(pages, backends)
+    print(f'{len(pages)} fixture pages, {mismatches} mismatches against html.parser')
+    print(f'{"backend":<12}' + ''.join(f'{kind:>14}' for kind in EXTRACTORS))
+    for backend in backends:
+        timings = time_backend(pages, backend, repeats)
+        print(f'{backend:<12}' + ''.join(f'{timings[kind] * 1000:>11.3f} ms' for kind in EXTRACTORS))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import async_surveys  # noqa: E402
+import surveys  # noqa: E402
+from fetch import Fetcher  # noqa: E402
+from bench.server import DAAC_PATH, PUBLIC_WEB_PATH  # noqa: E402
+from parsers import BACKENDS, DEFAULT_BACKEND, check_backend  # noqa: E402
+from scheduler import CrawlScheduler  # noqa: E402
+from session import SessionManager  # noqa: E402
+
+# Usage: python -m bench.run_bench [--engines sync threads async] [--copies 4] [--latency 0.05]
+#                                  [--error-rate 0.01] [--session-ttl 2] [--workers 8]
+# Starts bench/server.py, then runs each scraper engine end to end against it (DAAC index,
+# facility pages, eventid pages) in its own process, and reports pages/sec, p50/p99 page
+# latency, peak RSS and CPU per parsed page. Latency is timed around the engine's own fetch
+# function, so it includes retries and, for the async engine, time spent waiting on the
+# scheduler; errors are pages that still failed after every retry.
+# Output goes to a temporary directory; nothing is written to ./json.
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, start, response):
+        self.latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            self.errors += 1
+
+    def wrap(self, get):
+        def timed_get(*args, **kwargs):
+            start = time.perf_counter()
+            response = get(*args, **kwargs)
+            self.record(start, response)
+            return response
+        return timed_get
+
+    def wrap_async(self, fetch):
+        async def timed_fetch(*args, **kwargs):
+            start = time.perf_counter()
+            response = await fetch(*args, **kwargs)
+            self.record(start, response)
+            return response
+        return timed_fetch
+
+
+def run_sync(site, args, recorder, workers=1):
+    surveys.get_page = recorder.wrap(surveys.get_page)
+    client = surveys.create_session(pool_size=max(10, 2 * workers))
+    fetcher = Fetcher(attempts=args.retries, session=SessionManager(client.cookies))
+    base_url = f'{site}{PUBLIC_WEB_PATH}'
+    endpoints = surveys.discover_endpoints([f'{site}{DAAC_PATH}'], {}, parser=args.parser, fetcher=fetcher,
+                                           base_url=base_url, client=client)
+    surveys.run_app(endpoints, {}, None, None, parser=args.parser, base_url=base_url, fetcher=fetcher,
+                    client=client, workers=workers)
+    client.close()
+
+
+def run_threads(site, args, recorder):
+    run_sync(site, args, recorder, workers=args.workers)
+
+
+def run_async(site, args, recorder):
+    async_surveys.fetch_page = recorder.wrap_async(async_surveys.fetch_page)
+
+    async def crawl():
+        # Same wiring as async_surveys.main, minus the cache so every page is fetched
+        scheduler = CrawlScheduler(max_in_flight=32, initial_concurrency=8, rate_per_host=args.rate)
+        executor = ProcessPoolExecutor(max_workers=args.parse_workers) if args.parse_workers > 0 else None
+        base_url = f'{site}{PUBLIC_WEB_PATH}'
+        async with async_surveys.create_client() as client:
+            fetcher = Fetcher(attempts=args.retries, session=SessionManager(client.cookies))
+            endpoints = await async_surveys.discover_endpoints(client, [f'{site}{DAAC_PATH}'], {},
+                                                               scheduler=scheduler, parser=args.parser,
+                                                               executor=executor, fetcher=fetcher,
+                                                               base_url=base_url)
+            await async_surveys.crawl(client, endpoints, {}, scheduler=scheduler, parser=args.parser,
+                                      executor=executor, facility_workers=args.facility_workers,
+                                      base_url=base_url, fetcher=fetcher)
+        if executor is not None:
+            # Reap the parse workers so their CPU shows up in RUSAGE_CHILDREN
+            executor.shutdown()
+
+    asyncio.run(crawl())
+
+
+ENGINES = {
+    'sync': run_sync,
+    'threads': run_threads,
+    'async': run_async,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def usage():
+    # (cpu seconds, peak RSS in MB) for this process and the parse workers it has reaped
+    if resource is None:
+        return time.process_time(), None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak = max(own.ru_maxrss, children.ru_maxrss) / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return cpu, peak
+
+
+def run_child(args):
+    # Runs one engine in this (fresh) process and writes its measurements to args.result
+    recorder = Recorder()
+    cpu_start, _ = usage()
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        ENGINES[args.child](args.site, args, recorder)
+        os.chdir(REPO_DIR)
+    elapsed = time.perf_counter() - start
+    cpu_end, peak_rss = usage()
+    pages = len(recorder.latencies)
+    parsed = pages - recorder.errors
+    with open(args.result, 'w') as f:
+        json.dump({
+            'engine': args.child, 'pages': pages, 'errors': recorder.errors, 'seconds': elapsed,
+            'pages_per_sec': pages / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(recorder.latencies, 0.50) * 1000,
+            'p99_ms': percentile(recorder.latencies, 0.99) * 1000,
+            'peak_rss_mb': peak_rss,
+            'cpu_ms_per_page': (cpu_end - cpu_start) * 1000 / parsed if parsed else 0.0,
+        }, f)
+
+
+def start_server(args):
+    command = [sys.executable, '-m', 'bench.server', '--port', '0', '--copies', str(args.copies),
+               '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+               '--session-ttl', str(args.session_ttl)]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    server = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError('bench.server exited before it started serving')
+    print(line.strip())
+    return server, line.split()[-1]
+
+
+def child_command(args, engine, site, result):
+    return [sys.executable, '-m', 'bench.run_bench', '--child', engine, '--site', site, '--result', result,
+            '--parser', args.parser, '--rate', str(args.rate), '--parse-workers', str(args.parse_workers),
+            '--facility-workers', str(args.facility_workers), '--workers', str(args.workers),
+            '--retries', str(args.retries)]
+
+
+def print_table(results):
+    print(f'{"engine":<10}{"pages":>7}{"errors":>8}{"seconds":>9}{"pages/s":>9}{"p50 ms":>9}{"p99 ms":>9}'
+          f'{"peak MB":>9}{"cpu ms/page":>13}')
+    for r in results:
+        peak = f'{r["peak_rss_mb"]:.1f}' if r['peak_rss_mb'] is not None else 'n/a'
+        print(f'{r["engine"]:<10}{r["pages"]:>7}{r["errors"]:>8}{r["seconds"]:>9.2f}{r["pages_per_sec"]:>9.1f}'
+              f'{r["p50_ms"]:>9.1f}{r["p99_ms"]:>9.1f}{peak:>9}{r["cpu_ms_per_page"]:>13.2f}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the scrapers against the local stand-in server.')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--site', help='use an already running bench.server at this URL instead of starting one')
+    parser.add_argument('--copies', type=int, default=1, help='repeat the archive facilities this many times')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server adds to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency varies uniformly by +/- this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--seed', type=int, help='seed for the server\'s latency/error draws')
+    parser.add_argument('--session-ttl', type=float, default=0.0,
+                        help='seconds the server\'s session cookies last (0: no sessions)')
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=BACKENDS, help='HTML parsing backend')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='async scheduler requests/sec per host (the live crawl uses 4)')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count(),
+                        help='async parse processes (0 parses on the event loop)')
+    parser.add_argument('--facility-workers', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=8, help='surveys.py --workers for the threads engine')
+    parser.add_argument('--retries', type=int, default=4, help='attempts per page, as in the scrapers')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the scrapers\' own output')
+    parser.add_argument('--child', choices=list(ENGINES), help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    check_backend(args.parser)
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        return run_child(args)
+    server = None
+    if args.site is None:
+        server, args.site = start_server(args)
+    output = None if args.verbose else subprocess.DEVNULL
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for engine in args.engines:
+                result = os.path.join(tmp, f'{engine}.json')
+                subprocess.run(child_command(args, engine, args.site, result), cwd=REPO_DIR, check=True,
+                               stdout=output, stderr=output)
+                with open(result) as f:
+                    results.append(json.load(f))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import load_archive, render_facility, render_index, render_survey  # noqa: E402
+
+# Usage: python -m bench.server [--port 8000] [--latency 0.05] [--jitter 0.02] [--error-rate 0.01]
+#                               [--session-ttl 5]
+# A local stand-in for apps.health.pa.gov and sais.health.pa.gov serving the archive-built
+# pages at the same paths the scrapers request. Every page is rendered once up front, so
+# the server itself costs almost nothing next to the scraper being measured. With
+# --session-ttl the site root hands out a session cookie that lasts that many seconds, and
+# survey pages requested without a live one get the 200 Incapsula page the real site sends.
+
+DAAC_PATH = '/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx'
+# Any month's index is served, listing the same facilities, as consecutive months mostly do
+DAAC_MONTH_PATH = re.compile(r'^/surveyspostedDAAC/DAAC-SurveysPosted_\d{6}\.aspx$')
+# This month's index links with lowercase facid=...&page=1, so case-insensitive facid handling
+# is exercised end to end (bench/check_links.py)
+LOWERCASE_DAAC_PATH = '/surveyspostedDAAC/DAAC-SurveysPosted_202401.aspx'
+PUBLIC_WEB_PATH = '/CommonPOC/Content/PublicWeb/'
+SURVEY_PATH = f'{PUBLIC_WEB_PATH}ltc-survey.asp'
+SESSION_COOKIE = 'ASP.NET_SessionId'
+CHALLENGE_PAGE = (b'<html><head><title>Request Rejected</title></head><body>'
+                  b'Request unsuccessful. Incapsula incident ID: 0-000000000000000000</body></html>')
+
+
+def build_site(base_url, copies=1):
+    # copies > 1 repeats the archive facilities under new facids to make a longer crawl
+    facilities = []
+    for copy in range(copies):
+        for facid, name, surveys in load_archive():
+            if copy:
+                facid, name = f'{facid}{copy:03d}', f'{name} #{copy}'
+            facilities.append((facid, name, surveys))
+    listed = [(facid, name) for facid, name, _ in facilities]
+    index = render_index(listed, base_url).encode('utf-8')
+    lowercase_index = render_index(listed, base_url, lowercase=True).encode('utf-8')
+    pages = {}
+    for facid, name, surveys in facilities:
+        pages[facid.lower(), None] = render_facility(facid, name, surveys).encode('utf-8')
+        for survey in surveys:
+            pages[facid.lower(), survey['eventid'].lower()] = render_survey(facid, name, survey).encode('utf-8')
+    return index, lowercase_index, pages
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, copies=1, latency=0.0, jitter=0.0, error_rate=0.0, seed=None, session_ttl=0.0):
+        super().__init__(address, StandInHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.sessions = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.index, self.lowercase_index, self.pages = build_site(f'{self.url}{PUBLIC_WEB_PATH}', copies)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            failed = self.random.random() < self.error_rate
+        return max(0.0, delay), failed
+
+    def start_session(self):
+        token = secrets.token_hex(12)
+        with self.lock:
+            self.sessions[token] = time.monotonic() + self.session_ttl
+        return token
+
+    def session_alive(self, cookie_header):
+        if not self.session_ttl:
+            return True
+        cookies = dict(part.strip().split('=', 1) for part in (cookie_header or '').split(';') if '=' in part)
+        with self.lock:
+            expires = self.sessions.get(cookies.get(SESSION_COOKIE))
+        return expires is not None and expires > time.monotonic()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the scrapers' keep-alive pools behave as they do against the real site
+    protocol_version = 'HTTP/1.1'
+    # The headers and body go out in separate writes; with Nagle on, the body waits for the
+    # client's delayed ACK of the headers (~40ms per response on a kept-alive connection)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        delay, failed = self.server.delay()
+        time.sleep(delay)
+        if failed:
+            return self.respond(503, b'Service Unavailable', {'Retry-After': '1'})
+        url = urlparse(self.path)
+        query = {k.lower(): v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/' and self.server.session_ttl:
+            token = self.server.start_session()
+            return self.respond(200, b'<html><body>Home</body></html>',
+                                {'Set-Cookie': f'{SESSION_COOKIE}={token}; Path=/'})
+        if url.path == LOWERCASE_DAAC_PATH:
+            return self.respond(200, self.server.lowercase_index)
+        if DAAC_MONTH_PATH.match(url.path):
+            return self.respond(200, self.server.index)
+        if url.path.lower() == SURVEY_PATH.lower():
+            if not self.server.session_alive(self.headers.get('Cookie')):
+                return self.respond(200, CHALLENGE_PAGE)
+            key = (query.get('facid', '').lower(), query['eventid'].lower() if 'eventid' in query else None)
+            if key in self.server.pages:
+                return self.respond(200, self.server.pages[key])
+        self.respond(404, b'Not Found')
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the fixture site locally for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='0 picks a free port')
+    parser.add_argument('--copies', type=int, default=1, help='repeat the archive facilities this many times')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency varies uniformly by +/- this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--seed', type=int, help='seed for the latency/error draws')
+    parser.add_argument('--session-ttl', type=float, default=0.0,
+                        help='seconds a session cookie from / lasts; survey pages need one (0: no sessions)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = StandInServer((args.host, args.port), args.copies, args.latency, args.jitter, args.error_rate,
+                           args.seed, args.session_ttl)
+    # run_bench.py reads this first line to find the port
+    print(f'Serving {len(server.pages)} pages on {server.url}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+# Seconds a cached page is served without asking the server again. Finalized survey
+# pages (eventid=...) never change once posted, so they never expire.
+DEFAULT_TTLS = {
+    'index': 60 * 60,            # DAAC-SurveysPosted_YYYYMM.aspx
+    'survey_list': 6 * 60 * 60,  # ltc-survey.asp?Facid=... (SurveyList dropdown)
+    'survey': None,              # ltc-survey.asp?...&eventid=...
+    'other': 60 * 60,
+}
+
+
+def normalize_url(url: str) -> str:
+    # Facid/facid, PAGE/page and empty name= all name the same page on the PA DOH site
+    parsed = urlparse(url)
+    params = sorted((k.lower(), v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if v != '')
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{parsed.path.lower()}?{urlencode(params)}"
+
+
+def page_type(url: str) -> str:
+    parsed = urlparse(url)
+    params = {k.lower() for k, _ in parse_qsl(parsed.query)}
+    path = parsed.path.lower()
+    if 'surveysposted' in path:
+        return 'index'
+    if path.endswith('ltc-survey.asp'):
+        return 'survey' if 'eventid' in params else 'survey_list'
+    return 'other'
+
+
+class CachedResponse:
+    __slots__ = ('status_code', 'content', 'headers', 'from_cache')
+
+    def __init__(self, status_code, content, headers=None, from_cache=True):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class CacheEntry:
+    __slots__ = ('key', 'digest', 'etag', 'last_modified', 'stored_at', 'ttl')
+
+    def __init__(self, key, digest, etag, last_modified, stored_at, ttl):
+        self.key = key
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.ttl = ttl
+
+    def is_fresh(self, now=None):
+        if self.ttl is None:
+            return True
+        return (now or time.time()) - self.stored_at < self.ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, path: str = './cache', max_bytes: int = 512 * 1024 * 1024, ttls: dict = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        # Shared by the threads of surveys.py, so every use of the connection holds the lock
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self._lock = threading.RLock()
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, page_type TEXT, digest TEXT, size INTEGER,
+            etag TEXT, last_modified TEXT, stored_at REAL, accessed_at REAL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], f'{digest}.z')
+
+    def lookup(self, url: str):
+        key = normalize_url(url)
+        with self._lock:
+            row = self.db.execute('SELECT digest, etag, last_modified, stored_at, page_type FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+        if row is None:
+            return None
+        digest, etag, last_modified, stored_at, kind = row
+        return CacheEntry(key, digest, etag, last_modified, stored_at, self.ttls.get(kind))
+
+    def read(self, entry: CacheEntry):
+        try:
+            with open(self._object_path(entry.digest), 'rb') as f:
+                body = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            with self._lock:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (entry.key,))
+                self.db.commit()
+            return None
+        with self._lock:
+            self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), entry.key))
+            self.db.commit()
+        return body
+
+    def store(self, url: str, body: bytes, headers=None):
+        headers = headers or {}
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(digest)
+        # Content-addressed: identical bodies (e.g. the same error page) are stored once
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f'{object_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(body, 6))
+            os.replace(tmp_path, object_path)
+        now = time.time()
+        with self._lock:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (normalize_url(url), page_type(url), digest, os.path.getsize(object_path),
+                             headers.get('ETag'), headers.get('Last-Modified'), now, now))
+            self.db.commit()
+            self.evict()
+
+    def revalidated(self, entry: CacheEntry):
+        # 304 Not Modified: the stored body is good for another TTL
+        now = time.time()
+        with self._lock:
+            self.db.execute('UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, entry.key))
+            self.db.commit()
+
+    def discard(self, url: str):
+        # A 200 that turned out not to be the page the URL should hold (an error or maintenance
+        # page), dropped so the next run fetches it again instead of reading it back forever
+        with self._lock:
+            self.db.execute('DELETE FROM entries WHERE key = ?', (normalize_url(url),))
+            self.db.commit()
+
+    def evict(self):
+        with self._lock:
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, digest, size in self.db.execute(
+                    'SELECT key, digest, size FROM entries ORDER BY accessed_at').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+                if not self.db.execute('SELECT 1 FROM entries WHERE digest = ?', (digest,)).fetchone():
+                    try:
+                        os.remove(self._object_path(digest))
+                    except OSError:
+                        pass
+            self.db.commit()
+
+
+def cached_get(cache: ResponseCache, url: str, get, headers: dict = None, **kwargs):
+    # get is requests.get or a requests.Session.get
+    entry = cache.lookup(url)
+    if entry is not None and entry.is_fresh():
+        body = cache.read(entry)
+        if body is not None:
+            return CachedResponse(200, body)
+    request_headers = dict(headers or {})
+    if entry is not None:
+        request_headers.update(entry.conditional_headers())
+    response = get(url, headers=request_headers, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        body = cache.read(entry)
+        if body is not None:
+            cache.revalidated(entry)
+            return CachedResponse(200, body)
+        response = get(url, headers=headers, **kwargs)
+    if response.status_code == 200:
+        cache.store(url, response.content, response.headers)
+    return response
+
+
+async def async_cached_get(cache: ResponseCache, url: str, get, headers: dict = None, **kwargs):
+    # Same as cached_get, for a coroutine get (httpx.AsyncClient.get or CrawlScheduler.fetch)
+    entry = cache.lookup(url)
+    if entry is not None and entry.is_fresh():
+        body = cache.read(entry)
+        if body is not None:
+            return CachedResponse(200, body)
+    request_headers = dict(headers or {})
+    if entry is not None:
+        request_headers.update(entry.conditional_headers())
+    response = await get(url, headers=request_headers, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        body = cache.read(entry)
+        if body is not None:
+            cache.revalidated(entry)
+            return CachedResponse(200, body)
+        response = await get(url, headers=headers, **kwargs)
+    if response.status_code == 200:
+        cache.store(url, response.content, response.headers)
+    return response
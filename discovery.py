@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from state import facid_from_link
+
+# The DAAC "surveys posted" index is published once a month as DAAC-SurveysPosted_YYYYMM.aspx.
+# A run can read a range of months plus any other posted-surveys list given by URL; the
+# same facility shows up in many of them, so endpoints are merged by facid before scraping.
+DAAC_MONTH_URL = 'https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_{month}.aspx'
+
+
+def month_range(months: str) -> list:
+    # 'YYYYMM' or 'YYYYMM:YYYYMM' (inclusive) -> ['YYYYMM', ...]
+    start, _, end = months.partition(':')
+    current = datetime.strptime(start, '%Y%m')
+    last = datetime.strptime(end or start, '%Y%m')
+    if last < current:
+        raise ValueError(f"Month range {months!r} ends before it starts")
+    result = []
+    while current <= last:
+        result.append(current.strftime('%Y%m'))
+        current = current.replace(year=current.year + current.month // 12, month=current.month % 12 + 1)
+    return result
+
+
+def daac_urls(months: str = None, extra_urls: list = None, default: str = None) -> list:
+    urls = [DAAC_MONTH_URL.format(month=month) for month in month_range(months)] if months else []
+    urls += [url for url in extra_urls or [] if url not in urls]
+    if not urls and default:
+        urls.append(default)
+    return urls
+
+
+def dedupe_by_facid(endpoints) -> list:
+    # First endpoint seen for each facid; Facid/facid and PAGE=1/page=1 variants of one
+    # facility are the same work. Links without a facid fall back to exact-string dedupe.
+    seen = set()
+    unique = []
+    for link in endpoints:
+        facid = facid_from_link(link)
+        key = ('facid', facid.lower()) if facid else ('link', link)
+        if key not in seen:
+            seen.add(key)
+            unique.append(link)
+    return unique
@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import contextlib
+import functools
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import httpx
+
+from async_surveys import BASE_URL, DAAC_URL, create_client, discover_endpoints, scrape_pages, write_result
+from discovery import daac_urls
+from fetch import CircuitOpenError, DeadLetters, Fetcher
+from parsers import BACKENDS, DEFAULT_BACKEND, check_backend
+from scheduler import CrawlScheduler
+from session import SessionError, SessionManager, landing_urls
+from state import CrawlState, Fingerprints, facid_from_link
+from store import open_store
+from surveylist import SurveyFilter, add_filter_args
+
+# Coordinator/worker mode. `enqueue` discovers endpoints and queues one unit per facid in a
+# SQLite file; any number of `worker` processes lease units, scrape them with
+# async_surveys.scrape_pages and write to a shared store. A lease that is neither completed
+# nor extended within the visibility timeout goes back to the queue, so the facilities of a
+# worker that died are picked up by the others. Every request of every worker draws from
+# one token bucket per host kept in the same file, so adding workers spreads the crawl
+# without raising the request rate sais.health.pa.gov sees.
+# Workers on several hosts need the queue (and a sqlite store) on a filesystem with
+# working file locks, and clocks kept in sync, since leases and the budget use wall time.
+
+# Sinks several worker processes can share: sqlite serializes writers on the file lock and
+# parquet appends files named after the process. jsonl appends without a lock, and lines from
+# different workers could interleave.
+WORKER_SINKS = ('sqlite', 'parquet')
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+}
+
+
+class WorkQueue:
+    def __init__(self, path: str = './crawl_queue.sqlite', visibility_timeout: float = 300.0, max_attempts: int = 3):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        # Autocommit; every change runs in an explicit BEGIN IMMEDIATE so workers serialize on it.
+        # A worker's event loop calls in from worker threads, which share the connection behind
+        # a lock.
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS units (
+                facid TEXT PRIMARY KEY, link TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0, owner TEXT, lease_expires REAL, updated_at REAL);
+            CREATE INDEX IF NOT EXISTS units_status ON units (status, lease_expires);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS budget (
+                host TEXT PRIMARY KEY, tokens REAL, updated REAL, paused_until REAL);
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def configure(self, **settings):
+        with self.transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                           [(key, str(value)) for key, value in settings.items()])
+
+    def settings(self) -> dict:
+        with self._lock:
+            return dict(self.db.execute('SELECT key, value FROM settings'))
+
+    def enqueue(self, endpoints) -> int:
+        # A facid already queued (in any state) is left alone, so enqueueing again is harmless
+        now = time.time()
+        rows = [(facid_from_link(link), link, now) for link in endpoints if facid_from_link(link)]
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO units (facid, link, updated_at) VALUES (?, ?, ?)', rows)
+            return db.total_changes - before
+
+    def lease(self, owner: str):
+        # (facid, link) of the oldest pending unit or expired lease, or None
+        now = time.time()
+        with self.transaction() as db:
+            db.execute('''UPDATE units SET status = 'failed', owner = NULL, updated_at = ?
+                          WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?''',
+                       (now, now, self.max_attempts))
+            row = db.execute('''SELECT facid, link FROM units
+                                WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                                ORDER BY updated_at LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute('''UPDATE units SET status = 'leased', owner = ?, lease_expires = ?,
+                          attempts = attempts + 1, updated_at = ? WHERE facid = ?''',
+                       (owner, now + self.visibility_timeout, now, row[0]))
+            return row
+
+    def extend(self, facid: str, owner: str) -> bool:
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute('''UPDATE units SET lease_expires = ? WHERE facid = ? AND owner = ?
+                                   AND status = 'leased' ''', (now + self.visibility_timeout, facid, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, facid: str, owner: str):
+        with self.transaction() as db:
+            db.execute('''UPDATE units SET status = 'done', owner = NULL, lease_expires = NULL, updated_at = ?
+                          WHERE facid = ? AND owner = ?''', (time.time(), facid, owner))
+
+    def fail(self, facid: str, owner: str):
+        # Back to the queue until it has used max_attempts leases
+        with self.transaction() as db:
+            db.execute('''UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                          owner = NULL, lease_expires = NULL, updated_at = ? WHERE facid = ? AND owner = ?''',
+                       (self.max_attempts, time.time(), facid, owner))
+
+    def requeue_failed(self) -> int:
+        with self.transaction() as db:
+            return db.execute('''UPDATE units SET status = 'pending', attempts = 0, updated_at = ?
+                                 WHERE status = 'failed' ''', (time.time(),)).rowcount
+
+    def counts(self) -> dict:
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        with self._lock:
+            counts.update(self.db.execute('SELECT status, COUNT(*) FROM units GROUP BY status'))
+        return counts
+
+    def take_token(self, host: str, rate: float, capacity: float) -> float:
+        # One token from the host's shared bucket: 0.0 if granted, else seconds to wait
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute('SELECT tokens, updated, paused_until FROM budget WHERE host = ?', (host,)).fetchone()
+            tokens, updated, paused_until = row if row is not None else (capacity, now, 0.0)
+            if now < paused_until:
+                return paused_until - now
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if wait == 0.0:
+                tokens -= 1
+            db.execute('INSERT OR REPLACE INTO budget VALUES (?, ?, ?, ?)', (host, tokens, now, paused_until))
+            return wait
+
+    def pause_host(self, host: str, seconds: float):
+        now = time.time()
+        with self.transaction() as db:
+            db.execute('''INSERT INTO budget VALUES (?, 0, ?, ?) ON CONFLICT (host) DO UPDATE SET
+                          paused_until = MAX(paused_until, excluded.paused_until)''', (host, now, now + seconds))
+
+
+class SharedBucket:
+    # scheduler.TokenBucket with its state in the queue file, shared by every worker. The queue
+    # calls can wait up to 60s on another worker's BEGIN IMMEDIATE, so they run in threads
+    # instead of blocking the event loop.
+    def __init__(self, queue: WorkQueue, host: str, rate: float, capacity: float):
+        self.queue = queue
+        self.host = host
+        self.rate = rate
+        self.capacity = capacity
+
+    def pause(self, seconds: float):
+        # Called synchronously by the scheduler; the shared pause is written in the background
+        asyncio.get_running_loop().run_in_executor(None, self.queue.pause_host, self.host, seconds)
+
+    async def acquire(self):
+        while True:
+            wait = await asyncio.to_thread(self.queue.take_token, self.host, self.rate, self.capacity)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+async def keep_leased(queue: WorkQueue, facid: str, owner: str):
+    # A big facility can take longer than the visibility timeout; keep renewing the lease
+    while True:
+        await asyncio.sleep(queue.visibility_timeout / 3)
+        if not await asyncio.to_thread(queue.extend, facid, owner):
+            return
+
+
+async def lease_loop(queue: WorkQueue, owner: str, client: httpx.AsyncClient, scheduler: CrawlScheduler,
+                     base_url: str, args, fetcher: Fetcher, executor, writer: ThreadPoolExecutor, state, store,
+                     fingerprints=None):
+    survey_filter = SurveyFilter.from_args(args)
+    while True:
+        unit = await asyncio.to_thread(queue.lease, owner)
+        if unit is None:
+            counts = await asyncio.to_thread(queue.counts)
+            if not counts['pending'] and not counts['leased']:
+                return
+            # Other workers still hold leases; one of them may expire and come back
+            await asyncio.sleep(min(5.0, queue.visibility_timeout / 4))
+            continue
+        facid, link = unit
+        heartbeat = asyncio.create_task(keep_leased(queue, facid, owner))
+        try:
+            result = await scrape_pages(client, link, HEADERS, scheduler=scheduler, state=state, parser=args.parser,
+                                        executor=executor, base_url=base_url, fetcher=fetcher,
+                                        survey_filter=survey_filter, fingerprints=fingerprints)
+        except (httpx.HTTPError, CircuitOpenError, SessionError) as e:
+            print(f"Failed to scrape {link}: {e!r}")
+            result = None
+        finally:
+            heartbeat.cancel()
+        if result is None:
+            await asyncio.to_thread(queue.fail, facid, owner)
+            continue
+        # The store, state and fingerprint writes run on the one writer thread, off the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            writer, functools.partial(write_result, link, result, state, store, fingerprints=fingerprints))
+        await asyncio.to_thread(queue.complete, facid, owner)
+
+
+async def run_worker(args):
+    queue = WorkQueue(args.queue, args.visibility_timeout, args.max_attempts)
+    settings = queue.settings()
+    rate, burst = float(settings.get('rate', 4.0)), float(settings.get('burst', 8.0))
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    scheduler = CrawlScheduler(max_in_flight=32, initial_concurrency=8,
+                               bucket_factory=lambda host: SharedBucket(queue, host, rate, burst))
+    state = CrawlState(args.state) if args.incremental else None
+    store = open_store(args.sink, args.output)
+    fingerprints = Fingerprints(args.fingerprints) if args.fingerprints else None
+    executor = ProcessPoolExecutor(max_workers=args.parse_workers) if args.parse_workers > 0 else None
+    writer = ThreadPoolExecutor(max_workers=1)
+    async with create_client() as client:
+        # Each worker keeps its own site session in its client's cookie jar
+        fetcher = Fetcher(attempts=args.retries,
+                          dead_letters=DeadLetters(args.dead_letters) if args.dead_letters else None,
+                          session=SessionManager(client.cookies, landing_urls(args.landing_url)))
+        await asyncio.gather(*[lease_loop(queue, owner, client, scheduler, settings.get('base_url', BASE_URL), args,
+                                          fetcher, executor, writer, state, store, fingerprints)
+                               for _ in range(args.facility_workers)])
+    print(f'Worker {owner} finished: {queue.counts()}')
+    writer.shutdown()
+    if executor is not None:
+        executor.shutdown()
+    if fetcher.dead_letters is not None:
+        fetcher.dead_letters.close()
+    if state is not None:
+        state.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    if store is not None:
+        store.close()
+    queue.close()
+
+
+async def run_enqueue(args):
+    queue = WorkQueue(args.queue)
+    queue.configure(rate=args.rate, burst=args.burst, base_url=args.base_url)
+    async with create_client() as client:
+        endpoints = await discover_endpoints(client, daac_urls(args.months, args.daac_url, DAAC_URL), HEADERS,
+                                             parser=args.parser, base_url=args.base_url)
+    added = queue.enqueue(endpoints)
+    print(f'Queued {added} new facilities ({len(endpoints)} discovered): {queue.counts()}')
+    queue.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Crawl with several workers sharing one SQLite work queue.')
+    parser.add_argument('--queue', default='./crawl_queue.sqlite', help='work queue shared by all workers')
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=BACKENDS, help='HTML parsing backend')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='discover endpoints and queue one unit per facid')
+    enqueue.add_argument('--months', help='DAAC index months to read, YYYYMM or YYYYMM:YYYYMM (default: 202402)')
+    enqueue.add_argument('--daac-url', action='append', help='another posted-surveys list to read (repeatable)')
+    enqueue.add_argument('--base-url', default=BASE_URL, help='site the endpoints are relative to')
+    enqueue.add_argument('--rate', type=float, default=4.0, help='requests/sec per host across all workers')
+    enqueue.add_argument('--burst', type=float, default=8.0, help='burst allowance of the shared budget')
+
+    worker = commands.add_parser('worker', help='lease and scrape queued facilities until none are left')
+    worker.add_argument('--visibility-timeout', type=float, default=300.0,
+                        help='seconds before an unrenewed lease is handed to another worker')
+    worker.add_argument('--max-attempts', type=int, default=3, help='leases per facility before it is failed')
+    worker.add_argument('--facility-workers', type=int, default=4, help='facilities this worker scrapes at once')
+    worker.add_argument('--parse-workers', type=int, default=os.cpu_count(),
+                        help='processes used for HTML parsing (0 parses on the event loop)')
+    worker.add_argument('--sink', default='sqlite', choices=WORKER_SINKS, help='shared output store')
+    worker.add_argument('--output', help='path of the sqlite store or parquet directory')
+    worker.add_argument('--incremental', action='store_true',
+                        help='only fetch and save eventids not already recorded in the state store')
+    worker.add_argument('--state', default='./state.sqlite', help='state store used by --incremental')
+    worker.add_argument('--fingerprints', help='skip facilities and survey pages unchanged since they were last '
+                                               'written, keeping content hashes in this SQLite file')
+    add_filter_args(worker)
+    worker.add_argument('--retries', type=int, default=4, help='attempts per page before it is given up')
+    worker.add_argument('--landing-url', action='append', default=[],
+                        help='page a new site session starts from, per host (default: the site root)')
+    worker.add_argument('--dead-letters', help='list pages that kept failing in this file (one per worker)')
+
+    commands.add_parser('status', help='show how many facilities are pending, leased, done and failed')
+    commands.add_parser('requeue', help='put failed facilities back in the queue')
+    args = parser.parse_args()
+    check_backend(args.parser)
+    if args.command == 'worker':
+        args.incremental = args.incremental or args.since_last_scrape
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == 'enqueue':
+        asyncio.run(run_enqueue(args))
+    elif args.command == 'worker':
+        asyncio.run(run_worker(args))
+    else:
+        queue = WorkQueue(args.queue)
+        if args.command == 'requeue':
+            print(f'Requeued {queue.requeue_failed()} failed facilities')
+        print(queue.counts())
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()
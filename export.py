@@ -0,0 +1,162 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from import_archive import import_archive
+from parsers import DEFICIENCY_FIELDS
+from store import open_store, survey_records
+from surveylist import UNPARSED, parse_day
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Usage: python export.py surveys.sqlite --output ./surveys_parquet
+#        python export.py json/ --output ./surveys_parquet   (imports the archive first)
+# Writes surveys as a hive-partitioned Parquet dataset, year=YYYY/month=M/facid=F/*.parquet,
+# so a query for one year or facility only opens those directories. facility is dictionary
+# encoded, every column is zstd compressed, and deficiencies is a list<struct> column of the
+# parsers.DEFICIENCY_FIELDS rows (null when they were never extracted). Undated surveys and
+# archive surveys without a facid land in the __HIVE_DEFAULT_PARTITION__ directories.
+# The partition columns only exist as directory names, so they are written and read with
+# partitioning(); a reader inferring their types turns facid=061901 into the integer 61901
+# and can't open a dataset whose facids are all null. open_dataset() reads it back.
+PARTITION_COLUMNS = ['year', 'month', 'facid']
+COMPRESSION = 'zstd'
+
+
+def check_pyarrow():
+    if not HAVE_PYARROW:
+        raise ValueError("Parquet export needs the pyarrow package installed")
+
+
+def schema():
+    deficiency = pyarrow.struct([(field, pyarrow.string()) for field in DEFICIENCY_FIELDS])
+    return pyarrow.schema([
+        ('year', pyarrow.int16()), ('month', pyarrow.int8()), ('facid', pyarrow.string()),
+        ('facility', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ('eventid', pyarrow.string()), ('date', pyarrow.string()), ('survey_date', pyarrow.date32()),
+        ('data', pyarrow.large_string()), ('scraped_at', pyarrow.float64()),
+        ('deficiencies', pyarrow.list_(deficiency)),
+    ])
+
+
+def partitioning():
+    return pyarrow.dataset.partitioning(pyarrow.schema([schema().field(name) for name in PARTITION_COLUMNS]),
+                                        flavor='hive')
+
+
+def open_dataset(path: str):
+    check_pyarrow()
+    return pyarrow.dataset.dataset(path, format='parquet', schema=schema(), partitioning=partitioning())
+
+
+def records_table(records):
+    # store records (dicts with FIELDS, optionally 'deficiencies') -> one Arrow table
+    columns = {name: [] for name in schema().names}
+    for record in records:
+        day = parse_day(record['date']) if record.get('date') else UNPARSED
+        survey_date = date.fromordinal(day) if day != UNPARSED else None
+        columns['year'].append(survey_date.year if survey_date else None)
+        columns['month'].append(survey_date.month if survey_date else None)
+        columns['facid'].append(record.get('facid') or None)
+        columns['facility'].append(record.get('facility'))
+        columns['eventid'].append(record['eventid'])
+        columns['date'].append(record.get('date'))
+        columns['survey_date'].append(survey_date)
+        columns['data'].append(record.get('data'))
+        columns['scraped_at'].append(record.get('scraped_at'))
+        columns['deficiencies'].append(record.get('deficiencies'))
+    return pyarrow.Table.from_pydict(columns, schema=schema())
+
+
+def write_batch(records, path: str, basename: str):
+    pyarrow.parquet.write_to_dataset(records_table(records), path, partitioning=partitioning(),
+                                     basename_template=f'{basename}-{{i}}.parquet',
+                                     existing_data_behavior='overwrite_or_ignore',
+                                     compression=COMPRESSION, use_dictionary=['facility', 'facid', 'date'])
+
+
+class ParquetStore:
+    # Direct --sink parquet from the scrapers. Surveys are buffered and appended to the dataset
+    # batch_size at a time under a basename unique to this process, so several workers can
+    # share one directory. Nothing is ever rewritten: a survey scraped again is appended again,
+    # and readers keep the row with the newest scraped_at (python export.py rewrites a deduped
+    # dataset from the sqlite/jsonl store).
+    def __init__(self, path: str = './surveys_parquet', batch_size: int = 2000):
+        check_pyarrow()
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.batches = 0
+        self.run_id = f'{int(time.time())}-{os.getpid()}'
+
+    def write_records(self, records):
+        self.pending.extend(records)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def write(self, facid, facility):
+        self.write_records(survey_records(facid, facility))
+
+    def flush(self):
+        if self.pending:
+            write_batch(self.pending, self.path, f'part-{self.run_id}-{self.batches}')
+            self.batches += 1
+            self.pending = []
+
+    def close(self):
+        self.flush()
+
+
+def export(records, path: str, batch_size: int = 2000) -> int:
+    batch, batches, count = [], 0, 0
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            write_batch(batch, path, f'part-{batches}')
+            batches, count, batch = batches + 1, count + len(batch), []
+    if batch:
+        write_batch(batch, path, f'part-{batches}')
+        count += len(batch)
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export surveys to a partitioned Parquet dataset.')
+    parser.add_argument('source', help='a jsonl/sqlite store, or a json/ archive directory to import first')
+    parser.add_argument('--output', default='./surveys_parquet', help='dataset directory')
+    parser.add_argument('--replace', action='store_true', help='delete an existing dataset at --output first')
+    parser.add_argument('--batch-size', type=int, default=2000, help='surveys converted and written at a time')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    check_pyarrow()
+    if os.path.exists(args.output):
+        if not args.replace:
+            raise SystemExit(f'{args.output} already exists; pass --replace to overwrite it')
+        shutil.rmtree(args.output)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        if os.path.isdir(args.source):
+            # The archive holds several copies of most surveys; the importer's upsert keeps the newest
+            store = open_store('sqlite', os.path.join(tmp, 'archive.sqlite'))
+            import_archive([args.source], store)
+        else:
+            store = open_store('jsonl' if args.source.endswith('.jsonl') else 'sqlite', args.source)
+        count = export(store.iter_surveys(deficiencies=True), args.output, args.batch_size)
+        store.close()
+    print(f'Exported {count} surveys to {args.output} in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
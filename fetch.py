@@ -0,0 +1,234 @@
+import asyncio
+import functools
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+
+from metrics import METRICS
+from scheduler import CONGESTION_STATUSES, retry_after_seconds
+from session import SessionError, SessionManager
+from state import facid_from_link
+
+# One retry policy for both scrapers: Fetcher.get wraps requests.get (surveys.py) and
+# Fetcher.async_get wraps httpx/CrawlScheduler gets (async_surveys.py, test.py). Failures
+# are classified, retried with exponential backoff and full jitter, counted against a
+# per-host circuit breaker, and URLs that still fail end up in a replayable dead-letter file.
+# With a SessionManager, every attempt also goes through its expired-session check.
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host):
+        super().__init__(f'circuit open for {host}')
+        self.host = host
+
+
+def classify_error(error):
+    # Reason to retry an exception, or None if retrying would not help
+    if isinstance(error, (httpx.TimeoutException, requests.Timeout)):
+        return 'timeout'
+    if isinstance(error, (httpx.RemoteProtocolError, requests.exceptions.ChunkedEncodingError,
+                          requests.exceptions.ContentDecodingError)):
+        return 'truncated'
+    if isinstance(error, (httpx.TransportError, requests.ConnectionError)):
+        return 'connect'
+    if isinstance(error, SessionError):
+        return 'session'
+    return None
+
+
+def classify_response(response):
+    if response.status_code == 429:
+        return 'throttled'
+    if response.status_code in CONGESTION_STATUSES:
+        return 'server_error'
+    # A body shorter than its Content-Length was cut off mid-transfer
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and not response.headers.get('Content-Encoding'):
+        if len(response.content) < int(length):
+            return 'truncated'
+    return None
+
+
+class CircuitBreaker:
+    # Per host: after failure_threshold consecutive failures, stop sending requests for
+    # reset_timeout seconds, then let one trial request through (half-open). Its success
+    # closes the circuit again; its failure reopens it.
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = {}
+        self.opened_at = {}
+        self.trial = set()
+        self._lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at < self.reset_timeout or host in self.trial:
+                return False
+            self.trial.add(host)
+            return True
+
+    def record_success(self, host: str):
+        with self._lock:
+            self.failures.pop(host, None)
+            self.opened_at.pop(host, None)
+            self.trial.discard(host)
+
+    def record_failure(self, host: str):
+        with self._lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if host in self.trial or (host not in self.opened_at and self.failures[host] >= self.failure_threshold):
+                print(f'Circuit open for {host}; pausing requests for {self.reset_timeout:g}s')
+                METRICS.inc('circuit_opens_total')
+                self.opened_at[host] = time.monotonic()
+                self.trial.discard(host)
+
+
+class DeadLetters:
+    # URLs that failed every attempt, one JSON line each, written as they happen so a
+    # crashed run still leaves them behind. Runs append, so a --resume or --replay run never
+    # loses the list it was started to work through.
+    def __init__(self, path: str = './dead_letters.jsonl'):
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+        self.f = open(path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.f.close()
+
+    def add(self, url: str, reason: str, attempts: int, detail: str = None):
+        entry = {'url': url, 'reason': reason, 'attempts': attempts, 'detail': detail, 'failed_at': time.time()}
+        with self._lock:
+            self.entries.append(entry)
+            self.f.write(json.dumps(entry) + '\n')
+            self.f.flush()
+
+    @staticmethod
+    def load(path: str = './dead_letters.jsonl'):
+        # One entry per URL, the latest failure; runs that failed the same page append it again
+        latest = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    latest.pop(entry['url'], None)
+                    latest[entry['url']] = entry
+        return list(latest.values())
+
+
+def replay_endpoints(entries):
+    # The facility endpoints to scrape again for a list of dead letters; a failed eventid
+    # page replays its whole facility, which --incremental narrows back to the missing surveys
+    endpoints = []
+    for entry in entries:
+        facid = facid_from_link(entry['url'])
+        if facid:
+            endpoint = f'ltc-survey.asp?Facid={facid}&PAGE=1&SurveyType=H'
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+    return endpoints
+
+
+class Fetcher:
+    def __init__(self, attempts: int = 4, base_delay: float = 1.0, max_delay: float = 60.0,
+                 breaker: CircuitBreaker = None, dead_letters: DeadLetters = None, session: SessionManager = None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.dead_letters = dead_letters
+        self.session = session
+
+    def backoff(self, attempt: int, response=None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if response is not None and response.status_code == 429:
+            delay = max(delay, min(self.max_delay, retry_after_seconds(response, default=delay)))
+        return delay
+
+    def _after(self, host, reason):
+        # 429 is the site pacing us, not the host failing, so it does not trip the breaker
+        if reason is None:
+            self.breaker.record_success(host)
+        elif reason != 'throttled':
+            self.breaker.record_failure(host)
+
+    def _give_up(self, url, reason, attempts, detail=None):
+        print(f'Giving up on {url} after {attempts} attempt(s): {reason}')
+        METRICS.inc('fetch_failures_total', reason=reason)
+        if self.dead_letters is not None:
+            self.dead_letters.add(url, reason, attempts, detail)
+
+    def _check_error(self, url, host, attempt, error):
+        # Re-raises error unless it is worth another attempt
+        reason = classify_error(error)
+        self._after(host, reason or 'error')
+        if reason is None or attempt == self.attempts:
+            self._give_up(url, reason or 'error', attempt, repr(error))
+            raise error
+        METRICS.inc('fetch_retries_total', reason=reason)
+
+    def _done(self, url, host, attempt, response):
+        # True when response should be returned: a good one, or the last one we will get
+        reason = classify_response(response)
+        self._after(host, reason)
+        if reason is not None:
+            if attempt == self.attempts:
+                self._give_up(url, reason, attempt, f'HTTP {response.status_code}')
+            else:
+                METRICS.inc('fetch_retries_total', reason=reason)
+        return reason is None or attempt == self.attempts
+
+    def _circuit_open(self, url, host, attempt):
+        # A request refused by an open circuit counts as an attempt, so one that lands while
+        # another request is the half-open trial waits for it rather than failing outright
+        if attempt == self.attempts:
+            self._give_up(url, 'circuit_open', attempt, host)
+            raise CircuitOpenError(host)
+        METRICS.inc('fetch_retries_total', reason='circuit_open')
+
+    def get(self, get, url: str, **kwargs):
+        # get is requests.get or a requests.Session.get
+        host = urlparse(url).netloc.lower()
+        if self.session is not None:
+            get = functools.partial(self.session.get, get)
+        for attempt in range(1, self.attempts + 1):
+            response = None
+            if not self.breaker.allow(host):
+                self._circuit_open(url, host, attempt)
+            else:
+                try:
+                    response = get(url, **kwargs)
+                except Exception as e:
+                    self._check_error(url, host, attempt, e)
+                else:
+                    if self._done(url, host, attempt, response):
+                        return response
+            time.sleep(self.backoff(attempt, response))
+
+    async def async_get(self, get, url: str, **kwargs):
+        # Same as get, for a coroutine get (httpx.AsyncClient.get or CrawlScheduler.fetch)
+        host = urlparse(url).netloc.lower()
+        if self.session is not None:
+            get = functools.partial(self.session.async_get, get)
+        for attempt in range(1, self.attempts + 1):
+            response = None
+            if not self.breaker.allow(host):
+                self._circuit_open(url, host, attempt)
+            else:
+                try:
+                    response = await get(url, **kwargs)
+                except Exception as e:
+                    self._check_error(url, host, attempt, e)
+                else:
+                    if self._done(url, host, attempt, response):
+                        return response
+            await asyncio.sleep(self.backoff(attempt, response))
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from pools import ordered_map
+from store import open_store
+
+# survey_<name>.json, survey_<name>.N.json (surveys.save_json) and
+# YYYYMMDD_survey_<name>[.N].json (async_surveys.save_json)
+ARCHIVE_FILENAME = re.compile(r'^(?:(?P<stamp>\d{8})_)?survey_(?P<name>.+?)(?:\.(?P<counter>\d+))?\.json$')
+
+
+def archive_files(directories):
+    # (path, version) for every archive file; a higher version is a newer copy
+    for directory in directories:
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                match = ARCHIVE_FILENAME.match(filename)
+                if not match:
+                    continue
+                path = os.path.join(root, filename)
+                mtime = os.path.getmtime(path)
+                # Undated survey_<name>.json files are dated by when they were written
+                stamp = match['stamp'] or datetime.fromtimestamp(mtime).strftime('%Y%m%d')
+                yield path, (stamp, int(match['counter'] or 0), mtime)
+
+
+def load_file(path):
+    # Runs in a worker: returns [(facility, [(eventid, date, text, deficiencies)])] rather than the
+    # parsed JSON; deficiencies is None for files saved before they were extracted
+    with open(path, encoding='utf-8') as f:
+        content = json.load(f)
+    # test.py's old batch loop saved a list of facility results into one file
+    results = content if isinstance(content, list) else [content]
+    return [(result.get('facility', ''),
+             [(survey['eventid'], survey.get('date'), survey.get('data'), survey.get('deficiencies'))
+              for survey in result.get('data', [])])
+            for result in results if isinstance(result, dict)]
+
+
+def import_archive(directories, store, workers=None, report_every=500):
+    # Files are loaded oldest copy first, so the store's (facid, eventid) upsert leaves the
+    # newest copy of every survey; text from an older copy survives only where the newer one
+    # has none. The archives predate facids being recorded, so facility names are mapped
+    # to the facids the scrapers have already written, and left blank otherwise.
+    files = sorted(archive_files(directories), key=lambda item: item[1])
+    facids = store.facids()
+    seen = set()
+    surveys = 0
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = 4 * workers
+        for count, ((path, (stamp, _, _)), results) in enumerate(
+                zip(files, ordered_map(executor, load_file, [path for path, _ in files], window)), start=1):
+            scraped_at = datetime.strptime(stamp, '%Y%m%d').timestamp()
+            for facility, rows in results:
+                facid = facids.get(facility, '')
+                store.write_records([{'facid': facid, 'facility': facility, 'eventid': eventid, 'date': date,
+                                      'data': data, 'scraped_at': scraped_at, 'deficiencies': deficiencies}
+                                     for eventid, date, data, deficiencies in rows])
+                seen.update((facility, eventid) for eventid, _, _, _ in rows)
+                surveys += len(rows)
+            if count % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f'{count}/{len(files)} files, {count / elapsed:.1f} files/sec')
+    elapsed = time.perf_counter() - start
+    print(f'Imported {len(files)} files ({surveys} survey copies, {len(seen)} unique surveys) '
+          f'in {elapsed:.2f}s: {len(files) / elapsed if elapsed else 0:.1f} files/sec')
+    return len(files), len(seen)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load json/ archives into one consolidated store.')
+    parser.add_argument('directories', nargs='*', default=['./json'],
+                        help='archive directories, searched recursively (default ./json, which includes reviewed/)')
+    parser.add_argument('--sink', default='sqlite', choices=('jsonl', 'sqlite'))
+    parser.add_argument('--output', help='store path (default ./surveys.sqlite or ./surveys.jsonl)')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (default: cpu count)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = open_store(args.sink, args.output)
+    import_archive(args.directories, store, args.workers)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
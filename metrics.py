@@ -0,0 +1,232 @@
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Run metrics: counters, gauges and timings, recorded from the fetch, parse, queue and write
+# paths of all three scripts into the module-level METRICS. They can be scraped as Prometheus
+# text (--metrics-port), written as periodic JSON snapshots (--metrics-json), and are printed
+# as a summary at the end of every run.
+
+# httpcore trace events -> timing recorded for them. DNS resolution happens inside
+# connect_tcp, so it is part of the connect time.
+TRACE_STAGES = {
+    'connect_tcp': 'http_connect_seconds',
+    'start_tls': 'http_tls_seconds',
+    'receive_response_headers': 'http_ttfb_seconds',
+    'receive_response_body': 'http_download_seconds',
+}
+RESERVOIR_SIZE = 2048
+
+
+class Timing:
+    # Exact count/sum/max, and quantiles over the most recent RESERVOIR_SIZE observations
+    __slots__ = ('count', 'total', 'max', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def quantile(self, fraction):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.timings:
+                self.timings[key] = Timing()
+            self.timings[key].observe(seconds)
+
+    def timer(self, name: str, **labels):
+        return _Timer(self, name, labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'counters': {_series(name, labels): value for (name, labels), value in self.counters.items()},
+                'gauges': {_series(name, labels): value for (name, labels), value in self.gauges.items()},
+                'timings': {_series(name, labels): {'count': t.count, 'sum': t.total, 'max': t.max,
+                                                    'p50': t.quantile(0.5), 'p99': t.quantile(0.99)}
+                            for (name, labels), t in self.timings.items()},
+            }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines += [f'{_series(name, labels)} {value}'
+                              for (n, labels), value in sorted(series.items()) if n == name]
+            for name in sorted({name for name, _ in self.timings}):
+                lines.append(f'# TYPE {name} summary')
+                for (n, labels), t in sorted(self.timings.items()):
+                    if n != name:
+                        continue
+                    for q in (0.5, 0.99):
+                        lines.append(f'{_series(name, labels, [("quantile", q)])} {t.quantile(q)}')
+                    lines.append(f'{_series(name + "_sum", labels)} {t.total}')
+                    lines.append(f'{_series(name + "_count", labels)} {t.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f"Run metrics after {snapshot['uptime_seconds']:.1f}s:"]
+        for series, value in sorted(snapshot['counters'].items()):
+            lines.append(f'  {series:<60} {value:>12g}')
+        for series, t in sorted(snapshot['timings'].items()):
+            lines.append(f"  {series:<60} n={t['count']:<6} mean={t['sum'] / t['count'] * 1000:8.1f}ms "
+                         f"p50={t['p50'] * 1000:8.1f}ms p99={t['p99'] * 1000:8.1f}ms max={t['max'] * 1000:8.1f}ms")
+        for series, value in sorted(snapshot['gauges'].items()):
+            lines.append(f'  {series:<60} {value:>12g} (last)')
+        return '\n'.join(lines)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class RequestTrace:
+    # httpx 'trace' extension for an AsyncClient request: times the connect, TLS, time to
+    # first byte and body download stages from httpcore's started/complete events
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.started = {}
+
+    async def __call__(self, event: str, info: dict):
+        name, _, phase = event.rpartition('.')
+        stage = TRACE_STAGES.get(name.split('.', 1)[-1])
+        if stage is None:
+            return
+        if phase == 'started':
+            self.started[name] = time.perf_counter()
+        elif name in self.started:
+            self.metrics.observe(stage, time.perf_counter() - self.started.pop(name))
+
+
+def record_response(metrics, response, seconds: float):
+    # Totals every fetch path records once its response is in hand
+    if getattr(response, 'from_cache', False):
+        metrics.inc('cache_hits_total')
+        return
+    metrics.inc('http_responses_total', status=response.status_code)
+    metrics.inc('http_response_bytes_total', len(response.content))
+    metrics.observe('http_request_seconds', seconds)
+
+
+class MetricsExporter:
+    # Serves METRICS as Prometheus text on host:port and/or rewrites a JSON snapshot every
+    # interval. The default host only answers this machine.
+    def __init__(self, metrics, port: int = None, json_path: str = None, interval: float = 10.0,
+                 host: str = '127.0.0.1'):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.json_path = json_path
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+        self._writer = None
+
+    def start(self):
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.prometheus_text().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            host, port = self.server.server_address[:2]
+            print(f'Serving metrics on http://{host}:{port}/metrics')
+        if self.json_path is not None:
+            self._writer = threading.Thread(target=self._write_snapshots, daemon=True)
+            self._writer.start()
+        return self
+
+    def _write_snapshots(self):
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        tmp_path = f'{self.json_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.json_path)
+
+    def close(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self.write_snapshot()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+METRICS = Metrics()
@@ -0,0 +1,241 @@
+import re
+
+from bs4 import BeautifulSoup, Comment as SoupComment, NavigableString, SoupStrainer, UnicodeDammit
+
+try:
+    import lxml.html
+    from lxml.etree import Comment, ParserError
+    HAVE_LXML = True
+except ImportError:
+    HAVE_LXML = False
+
+# 'html.parser' builds the full BeautifulSoup tree, exactly as the scrapers always have.
+# 'strainer' uses the same parser but only builds the elements each extractor reads, so its
+# output is identical by construction and it is somewhat cheaper. 'lxml' skips
+# BeautifulSoup entirely and is roughly 8x faster on the fixtures; it repairs malformed
+# markup differently from html.parser, so bench/parse_bench.py checks its output against
+# html.parser before we rely on it. It is the default whenever lxml is installed.
+BACKENDS = ('html.parser', 'strainer', 'lxml')
+DEFAULT_BACKEND = 'lxml' if HAVE_LXML else 'strainer'
+
+INDEX_STRAINER = SoupStrainer('div', attrs={'class': 'content-container'})
+FACILITY_STRAINER = SoupStrainer(['font', 'select'])
+SURVEY_STRAINER = SoupStrainer('table')
+
+# One row per deficiency table of a survey page, in page order. kind is 'initial_comments'
+# (the report summary, kept in observations) or 'deficiency'. A deficiency's bold heading
+# "<tag> <category> <title>:" gives e.g. tag '103.22 (b)(16)', category 'LICENSURE' (or
+# CONDITION, STANDARD, ...), title 'IMPLEMENTATION'; regulation is the text quoted under it.
+# completion_date is the 'To be completed:' date of the plan of correction, as posted.
+DEFICIENCY_FIELDS = ('kind', 'tag', 'category', 'title', 'regulation', 'observations', 'plan', 'completion_date')
+DEFICIENCY_HEADING = re.compile(r'^(?P<tag>.+?)\s+(?P<category>[A-Z]{3,})\s+(?P<title>.*)$', re.S)
+PLAN_HEADING = re.compile(r'^\s*Plan of Correction(?:\s*-\s*To be completed:\s*(?P<date>\d{1,2}/\d{1,2}/\d{2,4}))?')
+
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend!r}, expected one of {BACKENDS}")
+    if backend == 'lxml' and not HAVE_LXML:
+        raise ValueError("The 'lxml' parser backend needs the lxml package installed")
+    return backend
+
+
+def _lxml_root(content):
+    # None for an empty (or comment-only) document, which the html.parser backends read as a
+    # page without the layout. lxml gets bytes, with the encoding BeautifulSoup would detect:
+    # left to itself it guesses latin-1 for undeclared bytes, and it refuses a str that starts
+    # with an XML encoding declaration.
+    if isinstance(content, str):
+        content, encoding = content.encode('utf-8'), 'utf-8'
+    elif content.strip():
+        encoding = UnicodeDammit(content, is_html=True).original_encoding or 'utf-8'
+    if not content.strip():
+        return None
+    try:
+        return lxml.html.fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+    except ParserError:
+        return None
+
+
+def _soup(content, backend, strainer):
+    if backend == 'strainer':
+        return BeautifulSoup(content, 'html.parser', parse_only=strainer)
+    return BeautifulSoup(content, 'html.parser')
+
+
+def parse_index_links(content, row_filter, backend=DEFAULT_BACKEND):
+    # hrefs from the first two cells of DAAC index rows whose 4th cell passes row_filter
+    if check_backend(backend) == 'lxml':
+        root = _lxml_root(content)
+        if root is None:
+            return []
+        containers = root.xpath('//div[contains(concat(" ", normalize-space(@class), " "), " content-container ")]')
+        tables = containers[0].iter('table') if containers else iter(())
+        table = next(tables, None)
+        if table is None:
+            return []
+        urls = []
+        for row in table.iter('tr'):
+            cells = list(row.iter('td'))
+            if len(cells) >= 4 and row_filter(cells[3].text_content()):
+                for cell in cells[:2]:
+                    anchors = list(cell.iter('a'))
+                    if anchors:
+                        urls.append(anchors[0].attrib['href'])
+        return urls
+
+    soup = _soup(content, backend, INDEX_STRAINER)
+    content_container = soup.find('div', class_='content-container')
+    table = content_container.find('table') if content_container else None
+    if table is None:
+        return []
+    urls = []
+    for row in table.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) >= 4 and row_filter(cells[3].text):
+            for cell in cells[:2]:
+                anchor = cell.find('a')
+                if anchor:
+                    urls.append(anchor['href'])
+    return urls
+
+
+def parse_facility_page(content, backend=DEFAULT_BACKEND):
+    # (facility name, [(eventid, date text)]) -- options is None when there is no SurveyList
+    if check_backend(backend) == 'lxml':
+        root = _lxml_root(content)
+        if root is None:
+            return '', None
+        facility_name = ''
+        fonts = root.xpath('//font[@size="+1"]')
+        if fonts:
+            facility_name = _first_direct_string(fonts[0]).strip()
+        selects = root.xpath('//select[@id="SurveyList"]')
+        if not selects:
+            return facility_name, None
+        options = [(option.get('value'), option.text_content().strip()) for option in selects[0].iter('option')]
+        return facility_name, options
+
+    soup = _soup(content, backend, FACILITY_STRAINER)
+    facility_name = ''
+    facility_name_tag = soup.find('font', {'size': '+1'})
+    if facility_name_tag:
+        for child in facility_name_tag.contents:
+            if isinstance(child, NavigableString):
+                facility_name = child.strip()
+                break
+    select_element = soup.find('select', id='SurveyList')
+    if not select_element:
+        return facility_name, None
+    options = [(option.get('value'), option.text.strip()) for option in select_element.find_all('option')]
+    return facility_name, options
+
+
+def _first_direct_string(element):
+    # lxml keeps text as .text/.tail rather than string nodes; mirror bs4's first NavigableString
+    if element.text is not None:
+        return element.text
+    for child in element:
+        if child.tag is Comment:
+            return child.text or ''
+        if child.tail is not None:
+            return child.tail
+    return ''
+
+
+def _deficiency(sections, plan_text):
+    # sections: [(bold label, text up to the next label)] from a deficiency table's left cell
+    label, body = sections[0] if sections else ('', '')
+    label = label.strip().rstrip(':').strip()
+    row = dict.fromkeys(DEFICIENCY_FIELDS, '')
+    if label.lower() == 'initial comments':
+        row['kind'] = 'initial_comments'
+        row['observations'] = body.strip()
+    else:
+        row['kind'] = 'deficiency'
+        match = DEFICIENCY_HEADING.match(label)
+        if match:
+            row.update(match.groupdict())
+        else:
+            row['tag'] = label
+        row['regulation'] = body.strip()
+    for label, body in sections[1:]:
+        label = label.strip().rstrip(':').strip()
+        if label.lower() == 'observations':
+            row['observations'] = ' '.join(filter(None, (row['observations'], body.strip())))
+        else:
+            # Any other bold label stays with the observations rather than being dropped
+            row['observations'] = ' '.join(filter(None, (row['observations'], f'{label}: {body.strip()}')))
+    match = PLAN_HEADING.match(plan_text)
+    if match:
+        row['completion_date'] = match.group('date') or ''
+        plan_text = plan_text[match.end():]
+    row['plan'] = plan_text.lstrip(' :').strip()
+    return tuple(row[field] for field in DEFICIENCY_FIELDS)
+
+
+def _lxml_sections(cell):
+    # lxml keeps text as .text/.tail; text before the first bold label is not part of any section
+    sections = []
+    pieces = [cell.text or '']
+    for child in cell:
+        if child.tag == 'b':
+            if sections:
+                sections[-1][1] = ''.join(pieces)
+            sections.append([child.text_content(), ''])
+            pieces = []
+        elif child.tag is not Comment:
+            pieces.append(child.text_content())
+        pieces.append(child.tail or '')
+    if sections:
+        sections[-1][1] = ''.join(pieces)
+    return [tuple(section) for section in sections]
+
+
+def _soup_sections(cell):
+    sections = []
+    pieces = []
+    for child in cell.children:
+        if isinstance(child, SoupComment):
+            continue
+        if isinstance(child, NavigableString):
+            pieces.append(str(child))
+        elif child.name == 'b':
+            if sections:
+                sections[-1][1] = ''.join(pieces)
+            sections.append([child.get_text(), ''])
+            pieces = []
+        else:
+            pieces.append(child.get_text())
+    if sections:
+        sections[-1][1] = ''.join(pieces)
+    return [tuple(section) for section in sections]
+
+
+def parse_survey_page(content, backend=DEFAULT_BACKEND):
+    # (text, deficiencies) in one pass over the page: text is the deficiency tables' text
+    # (everything after the 5 layout tables, minus the footer), deficiencies one
+    # DEFICIENCY_FIELDS tuple per deficiency table. (None, []) when the page does not have the
+    # survey layout at all.
+    if check_backend(backend) == 'lxml':
+        root = _lxml_root(content)
+        tables = list(root.iter('table')) if root is not None else []
+        if len(tables) < 5:
+            return None, []
+        texts, deficiencies = [], []
+        for table in tables[5:-1]:
+            texts.append(table.text_content().strip())
+            cells = list(table.iter('td'))
+            if len(cells) >= 2:
+                deficiencies.append(_deficiency(_lxml_sections(cells[0]), cells[1].text_content()))
+        return ' '.join(texts), deficiencies
+    tables = _soup(content, backend, SURVEY_STRAINER).find_all('table')
+    if len(tables) < 5:
+        return None, []
+    texts, deficiencies = [], []
+    for table in tables[5:-1]:
+        texts.append(table.text.strip())
+        cells = table.find_all('td')
+        if len(cells) >= 2:
+            deficiencies.append(_deficiency(_soup_sections(cells[0]), cells[1].text))
+    return ' '.join(texts), deficiencies
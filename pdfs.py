@@ -0,0 +1,200 @@
+import argparse
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+from fetch import CircuitOpenError, DeadLetters, Fetcher
+from metrics import METRICS
+from pools import ordered_map
+from session import SessionError, SessionManager, landing_urls
+from store import SqliteStore
+from surveys import create_session, get_page
+
+try:
+    import pypdf
+    HAVE_PYPDF = True
+except ImportError:
+    HAVE_PYPDF = False
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Usage: python pdfs.py --pdf-url 'https://.../{facid}/{eventid}.pdf' [--store surveys.sqlite]
+#        python pdfs.py   (only the PDFs already in --pdf-dir, named <facid>_<eventid>.pdf)
+# Text of the Statement of Deficiencies PDFs (CMS-2567, see misc/pdf) for every survey in the
+# sqlite store. Each PDF is downloaded once into --pdf-dir through the scrapers' Fetcher and
+# session manager, then split into tasks of --pages-per-task pages for a process pool. A
+# worker memory-maps the file, so pypdf only reads in the objects of the pages it extracts,
+# and returns just those pages' text, which is written to the store's pdf_pages table under
+# the survey's (facid, eventid) as each task finishes, in order.
+PDF_DIR = './pdfs'
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+}
+# How much of a response is searched for the %PDF header
+PDF_HEADER_BYTES = 1024
+
+
+def check_pypdf():
+    if not HAVE_PYPDF:
+        raise ValueError("PDF extraction needs the pypdf package installed")
+
+
+def pdf_path(pdf_dir: str, facid: str, eventid: str) -> str:
+    return os.path.join(pdf_dir, f'{facid}_{eventid}.pdf')
+
+
+def download(url: str, path: str, headers: dict = None, fetcher: Fetcher = None, client=None) -> bool:
+    response = get_page(url, headers=headers, fetcher=fetcher, client=client)
+    if response.status_code != 200 or b'%PDF' not in response.content[:PDF_HEADER_BYTES]:
+        print(f"No PDF at {url}: HTTP {response.status_code}")
+        return False
+    # Written under a temporary name and swapped in, so a half-written file is never extracted
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(response.content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def fetch_documents(keys, pdf_dir: str, pdf_url: str = None, headers: dict = None, fetcher: Fetcher = None,
+                    client=None, workers: int = 4):
+    # (facid, eventid, path) for every survey whose PDF is on disk, downloading the missing
+    # ones on a thread pool. Posted reports don't change, so a PDF on disk is never refetched.
+    def fetch(key):
+        facid, eventid = key
+        path = pdf_path(pdf_dir, facid, eventid)
+        if os.path.exists(path):
+            return facid, eventid, path
+        if pdf_url is None:
+            return facid, eventid, None
+        try:
+            found = download(pdf_url.format(facid=facid, eventid=eventid), path, headers=headers,
+                             fetcher=fetcher, client=client)
+        except (requests.RequestException, CircuitOpenError, SessionError) as e:
+            print(f"Failed to fetch the PDF for {facid} {eventid}: {e!r}")
+            found = False
+        return facid, eventid, path if found else None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for facid, eventid, path in ordered_map(pool, fetch, keys, 2 * workers):
+            if path is not None:
+                yield facid, eventid, path
+
+
+def limit_memory(megabytes: int):
+    # Pool initializer: past this much address space a worker gets MemoryError instead of
+    # growing until the machine swaps
+    if megabytes and resource is not None:
+        limit = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def page_count(path: str) -> int:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return len(pypdf.PdfReader(data).pages)
+
+
+def extract_pages(task):
+    # Runs in a worker: task is (facid, eventid, path, start, stop, page count), and the text of
+    # pages start..stop-1 comes back numbered from 1. A page pypdf can't read keeps text None.
+    facid, eventid, path, start, stop, count = task
+    began = time.perf_counter()
+    pages = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        reader = pypdf.PdfReader(data)
+        for number in range(start, stop):
+            try:
+                text = reader.pages[number].extract_text()
+            except (pypdf.errors.PyPdfError, MemoryError) as e:
+                print(f"Can't extract page {number + 1} of {path}: {e!r}")
+                text = None
+            pages.append((number + 1, text))
+        # Drop pypdf's hold on the map before it is closed
+        del reader
+    return facid, eventid, stop, count, pages, time.perf_counter() - began
+
+
+def extract(store: SqliteStore, documents, executor: ProcessPoolExecutor, pages_per_task: int = 8,
+            window: int = 16):
+    # Every document's tasks are queued in page order and written back in that order; only
+    # window tasks' text is ever held in this process. Returns (pages, documents) written.
+    written_pages, written_documents = 0, 0
+
+    def tasks():
+        nonlocal written_documents
+        for facid, eventid, path in documents:
+            try:
+                count = page_count(path)
+            except (pypdf.errors.PyPdfError, ValueError) as e:
+                print(f"Can't read {path}: {e!r}")
+                continue
+            if not count:
+                store.write_pdf_pages(facid, eventid, [], 0)
+                written_documents += 1
+            for start in range(0, count, pages_per_task):
+                yield facid, eventid, path, start, min(start + pages_per_task, count), count
+
+    for facid, eventid, stop, count, pages, seconds in ordered_map(executor, extract_pages, tasks(), window):
+        METRICS.observe('parse_seconds', seconds, page='extract_pages')
+        with METRICS.timer('write_seconds', sink='pdf_pages'):
+            # The last task of a document marks it complete
+            store.write_pdf_pages(facid, eventid, pages, count if stop == count else None)
+        METRICS.inc('pdf_pages_total', len(pages))
+        written_pages += len(pages)
+        written_documents += stop == count
+    return written_pages, written_documents
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extract the text of survey PDF reports into the sqlite store.')
+    parser.add_argument('--store', default='./surveys.sqlite', help='sqlite store the scrapers wrote')
+    parser.add_argument('--pdf-url', help='URL of a survey\'s PDF, with {facid} and {eventid} placeholders '
+                                          '(without it, only PDFs already in --pdf-dir are extracted)')
+    parser.add_argument('--pdf-dir', default=PDF_DIR, help='where PDFs are downloaded, as <facid>_<eventid>.pdf')
+    parser.add_argument('--landing-url', action='append', default=[],
+                        help='page a new site session starts from, per host (default: the site root)')
+    parser.add_argument('--download-workers', type=int, default=4, help='PDFs downloaded at once')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='extraction processes')
+    parser.add_argument('--pages-per-task', type=int, default=8, help='pages a worker extracts per task')
+    parser.add_argument('--tasks-per-worker', type=int, default=50,
+                        help='tasks before a worker process is replaced, releasing its memory (0: never)')
+    parser.add_argument('--worker-memory-mb', type=int, help='address space limit of each worker process')
+    parser.add_argument('--retries', type=int, default=4, help='attempts per PDF before it is dead-lettered')
+    parser.add_argument('--dead-letters', default='./pdf_dead_letters.jsonl',
+                        help='PDFs that failed every attempt (kept apart from the scrapers\' --replay file)')
+    parser.add_argument('--force', action='store_true', help='extract surveys whose PDF text is already stored')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    check_pypdf()
+    start = time.perf_counter()
+    store = SqliteStore(args.store)
+    keys = store.survey_keys(skip_extracted=not args.force)
+    os.makedirs(args.pdf_dir, exist_ok=True)
+    client = create_session(pool_size=max(10, args.download_workers))
+    fetcher = Fetcher(attempts=args.retries, dead_letters=DeadLetters(args.dead_letters),
+                      session=SessionManager(client.cookies, landing_urls(args.landing_url)))
+    documents = fetch_documents(keys, args.pdf_dir, args.pdf_url, headers=HEADERS, fetcher=fetcher, client=client,
+                                workers=args.download_workers)
+    # max_tasks_per_child is Python 3.11+, so it is only passed when recycling is asked for
+    recycle = {'max_tasks_per_child': args.tasks_per_worker} if args.tasks_per_worker else {}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=limit_memory, initargs=(args.worker_memory_mb,),
+                             **recycle) as executor:
+        pages, extracted = extract(store, documents, executor, args.pages_per_task, 2 * args.workers)
+    client.close()
+    fetcher.dead_letters.close()
+    store.close()
+    print(f'Extracted {pages} pages from {extracted} of {len(keys)} survey PDFs in {time.perf_counter() - start:.2f}s')
+    print(METRICS.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import collections
+
+# Helpers shared by the scripts that fan work out to a thread or process pool
+# (surveys.py --workers, import_archive.py, pdfs.py).
+
+
+def ordered_map(executor, func, items, window):
+    # Like executor.map, but never more than window results are pending or buffered
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
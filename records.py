@@ -0,0 +1,72 @@
+import json
+import sys
+import zlib
+from datetime import date
+
+from parsers import DEFICIENCY_FIELDS
+from surveylist import UNPARSED, parse_day
+
+# What scrape_pages returns and the writers consume. A month of results can be held in
+# memory for diffing, so the records are slotted, the ids and date strings (which repeat
+# across facilities and runs) are interned, and each survey's text is kept zlib-compressed
+# and only decoded when a writer asks for it, as are its structured deficiency rows
+# (parsers.DEFICIENCY_FIELDS tuples). to_dict() gives the json output shape,
+# {'facility': ..., 'data': [{'eventid', 'date', 'data', 'deficiencies'}]}. fingerprint is
+# the state.Fingerprints hash of the survey page body / the facility's selected options.
+
+
+class Survey:
+    __slots__ = ('eventid', 'date_text', 'day', '_text', '_deficiencies', 'fingerprint')
+
+    def __init__(self, eventid: str, date_text: str, text: str = None, deficiencies: list = None,
+                 fingerprint: str = None):
+        self.eventid = sys.intern(eventid)
+        self.date_text = sys.intern(date_text) if date_text is not None else None
+        self.day = parse_day(date_text) if date_text is not None else UNPARSED
+        # None means the page was not fetched or had no survey tables, as a missing 'data' key did
+        self._text = zlib.compress(text.encode('utf-8'), 6) if text is not None else None
+        self._deficiencies = zlib.compress(json.dumps(deficiencies).encode('utf-8'), 6) if deficiencies else None
+        self.fingerprint = fingerprint
+
+    @property
+    def has_text(self) -> bool:
+        return self._text is not None
+
+    @property
+    def text(self):
+        if self._text is None:
+            return None
+        return zlib.decompress(self._text).decode('utf-8')
+
+    @property
+    def deficiencies(self) -> list:
+        if self._deficiencies is None:
+            return []
+        return [tuple(row) for row in json.loads(zlib.decompress(self._deficiencies))]
+
+    def deficiency_dicts(self) -> list:
+        return [dict(zip(DEFICIENCY_FIELDS, row)) for row in self.deficiencies]
+
+    @property
+    def date(self):
+        return date.fromordinal(self.day) if self.day != UNPARSED else None
+
+    def to_dict(self) -> dict:
+        survey = {'eventid': self.eventid, 'date': self.date_text}
+        if self._text is not None:
+            survey['data'] = self.text
+            survey['deficiencies'] = self.deficiency_dicts()
+        return survey
+
+
+class Facility:
+    __slots__ = ('facid', 'name', 'surveys', 'fingerprint')
+
+    def __init__(self, facid: str, name: str, surveys: list = None, fingerprint: str = None):
+        self.facid = sys.intern(facid) if facid else facid
+        self.name = sys.intern(name)
+        self.surveys = surveys if surveys is not None else []
+        self.fingerprint = fingerprint
+
+    def to_dict(self) -> dict:
+        return {'facility': self.name, 'data': [survey.to_dict() for survey in self.surveys]}
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+# Status codes the PA DOH front end (Incapsula) answers with when it wants us to slow down
+CONGESTION_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        # Retry-After from the server: nobody talks to this host until it has passed
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    # AIMD: grow the in-flight cap by one after a window of healthy responses,
+    # cut it multiplicatively on 429/5xx/timeouts.
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32,
+                 decrease_factor: float = 0.5, increase_after: int = 10, cooldown: float = 2.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.increase_after = increase_after
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, congested: bool):
+        async with self._cond:
+            self.in_flight -= 1
+            if congested:
+                self.successes = 0
+                now = time.monotonic()
+                # One burst of failures from the same overload should only shrink us once
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
+                    self.last_decrease = now
+            else:
+                self.successes += 1
+                if self.successes >= self.increase_after and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self._cond.notify_all()
+
+
+class CrawlScheduler:
+    def __init__(self, max_in_flight: int = 32, initial_concurrency: int = 8, min_concurrency: int = 1,
+                 rate_per_host: float = 4.0, burst_per_host: float = 8.0, bucket_factory=None):
+        self.limiter = AdaptiveLimiter(initial=min(initial_concurrency, max_in_flight),
+                                       minimum=min_concurrency, maximum=max_in_flight)
+        self.rate_per_host = rate_per_host
+        self.burst_per_host = burst_per_host
+        # bucket_factory(host) can supply any object with acquire()/pause(), e.g. the
+        # cross-process budget in distributed.py; by default each host gets a TokenBucket
+        self.bucket_factory = bucket_factory
+        self.buckets = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc.lower()
+        if host not in self.buckets:
+            if self.bucket_factory is not None:
+                self.buckets[host] = self.bucket_factory(host)
+            else:
+                self.buckets[host] = TokenBucket(self.rate_per_host, self.burst_per_host)
+        return self.buckets[host]
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, **kwargs):
+        # Timeouts and connection errors propagate, but still count as congestion
+        bucket = self.bucket(url)
+        await self.limiter.acquire()
+        congested = True
+        try:
+            await bucket.acquire()
+            response = await client.get(url, **kwargs)
+            congested = response.status_code in CONGESTION_STATUSES
+            if response.status_code == 429:
+                bucket.pause(retry_after_seconds(response, default=5.0))
+            return response
+        finally:
+            await self.limiter.release(congested)
+
+
+def retry_after_seconds(response: httpx.Response, default: float) -> float:
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
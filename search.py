@@ -0,0 +1,148 @@
+import argparse
+import re
+import sqlite3
+from datetime import datetime
+
+from store import open_store, survey_records
+
+# SQLite FTS5 index over the survey text. A surveys table holds the filterable columns
+# and survey_fts holds the text, sharing rowids, so date/facility filters and relevance
+# ranking run in one query.
+FTS_OPERATORS = ('AND', 'OR', 'NOT')
+# A quoted phrase, a parenthesis, or a bare term
+FTS_TOKEN = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+
+
+def fts_query(query: str) -> str:
+    # Bare terms are quoted so their punctuation is searched as text (infection-control is the
+    # phrase "infection control") instead of being read as FTS5 syntax. Phrases, parentheses,
+    # AND/OR/NOT and a trailing * for prefix search keep their meaning.
+    terms = []
+    for token in FTS_TOKEN.findall(query):
+        if token.startswith('"') or token in ('(', ')') or token in FTS_OPERATORS:
+            terms.append(token)
+        elif token.endswith('*') and token != '*':
+            terms.append(f'"{token[:-1]}"*')
+        else:
+            terms.append(f'"{token}"')
+    return ' '.join(terms)
+
+
+def like_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def iso_date(date_text):
+    try:
+        return datetime.strptime(date_text, "%m/%d/%Y").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+class SearchIndex:
+    def __init__(self, path: str = './search.sqlite'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS surveys (
+                id INTEGER PRIMARY KEY, facid TEXT NOT NULL, eventid TEXT NOT NULL,
+                facility TEXT, date TEXT, survey_date TEXT, UNIQUE (facid, eventid));
+            CREATE INDEX IF NOT EXISTS surveys_date ON surveys (survey_date);
+            CREATE VIRTUAL TABLE IF NOT EXISTS survey_fts USING fts5(
+                facility, data, tokenize = 'porter unicode61');
+        ''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def add_records(self, records):
+        # Re-adding a survey replaces its text, so the index can be updated as surveys are saved
+        for record in records:
+            if not record.get('data'):
+                continue
+            row = self.db.execute('SELECT id FROM surveys WHERE facid = ? AND eventid = ?',
+                                  (record['facid'], record['eventid'])).fetchone()
+            if row is None:
+                cursor = self.db.execute(
+                    'INSERT INTO surveys (facid, eventid, facility, date, survey_date) VALUES (?, ?, ?, ?, ?)',
+                    (record['facid'], record['eventid'], record['facility'], record['date'],
+                     iso_date(record['date'])))
+                rowid = cursor.lastrowid
+            else:
+                rowid = row[0]
+                self.db.execute('UPDATE surveys SET facility = ?, date = ?, survey_date = ? WHERE id = ?',
+                                (record['facility'], record['date'], iso_date(record['date']), rowid))
+                self.db.execute('DELETE FROM survey_fts WHERE rowid = ?', (rowid,))
+            self.db.execute('INSERT INTO survey_fts (rowid, facility, data) VALUES (?, ?, ?)',
+                            (rowid, record['facility'], record['data']))
+        self.db.commit()
+
+    def write(self, facid, facility):
+        self.add_records(survey_records(facid, facility))
+
+    def search(self, query: str, since: str = None, until: str = None, facility: str = None, limit: int = 20):
+        # query uses FTS5 syntax: nurse call (both words), "nurse call" (phrase), infection OR sepsis,
+        # with bare terms quoted by fts_query.
+        # since/until are YYYY-MM-DD; facility matches a facid or part of the facility name.
+        sql = '''SELECT s.facid, s.facility, s.eventid, s.date,
+                        snippet(survey_fts, 1, '[', ']', '...', 16), bm25(survey_fts)
+                 FROM survey_fts JOIN surveys s ON s.id = survey_fts.rowid
+                 WHERE survey_fts MATCH ?'''
+        params = [fts_query(query)]
+        if since:
+            sql += ' AND s.survey_date >= ?'
+            params.append(since)
+        if until:
+            sql += ' AND s.survey_date <= ?'
+            params.append(until)
+        if facility:
+            # % and _ in the name are matched literally
+            sql += " AND (s.facid = ? OR s.facility LIKE ? ESCAPE '\\')"
+            params += [facility, f'%{like_escape(facility)}%']
+        sql += ' ORDER BY bm25(survey_fts) LIMIT ?'
+        params.append(limit)
+        return [{'facid': facid, 'facility': name, 'eventid': eventid, 'date': date, 'snippet': snippet,
+                 'score': -score}
+                for facid, name, eventid, date, snippet, score in self.db.execute(sql, params)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Full-text search over scraped survey text.')
+    parser.add_argument('--index', default='./search.sqlite', help='search index path')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='index every survey in a jsonl/sqlite store')
+    build.add_argument('store', help='path of the store written with --sink jsonl/sqlite')
+    query = commands.add_parser('query', help='search the index')
+    query.add_argument('query', help='FTS5 query, e.g. \'"nurse call"\' or "infection control"')
+    query.add_argument('--since', help='earliest survey date, YYYY-MM-DD')
+    query.add_argument('--until', help='latest survey date, YYYY-MM-DD')
+    query.add_argument('--facility', help='facid or part of the facility name')
+    query.add_argument('--limit', type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = SearchIndex(args.index)
+    if args.command == 'build':
+        store = open_store('jsonl' if args.store.endswith('.jsonl') else 'sqlite', args.store)
+        index.add_records(store.iter_surveys())
+        store.close()
+        count = index.db.execute('SELECT COUNT(*) FROM surveys').fetchone()[0]
+        print(f'{count} surveys indexed in {args.index}')
+    else:
+        try:
+            hits = index.search(args.query, args.since, args.until, args.facility, args.limit)
+        except sqlite3.OperationalError as e:
+            # What quoting can't fix, e.g. a dangling OR or an unclosed parenthesis
+            print(f"Can't search for {args.query!r}: {e}")
+            hits = []
+        for hit in hits:
+            print(f"{hit['date']:>10}  {hit['facility']} ({hit['facid']}) eventid {hit['eventid']}")
+            print(f"            {hit['snippet']}")
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+from metrics import METRICS
+
+# The site hands out its ASP/ASP.NET session and Incapsula cookies on the first page a
+# browser loads, and when they expire it keeps answering 200 with a challenge or
+# "session expired" page instead of the survey. A SessionManager starts a session per host
+# from a landing page into the client's own cookie jar (so every pooled connection shares
+# it), checks each response for those pages, and on the first one clears the host's
+# cookies, starts a new session and replays the request. Requests that saw the same dead
+# session while it was being replaced just replay. Fetcher applies it to every attempt.
+
+CHALLENGE_MARKERS = (b'_Incapsula_Resource', b'Incapsula incident ID', b'Request unsuccessful. Incapsula')
+EXPIRED_MARKERS = (b'session has expired', b'session has timed out', b'session expired')
+# Both kinds of page are short; real pages are only searched this far
+MARKER_SCAN_BYTES = 8192
+# Request options the landing page shares with the request that needed it. The timeout above
+# all: the landing request runs under the lock, so without one a stalled page hangs every thread.
+LANDING_KWARGS = ('headers', 'cookies', 'timeout')
+
+
+class SessionError(Exception):
+    pass
+
+
+def session_problem(response):
+    # 'challenge', 'expired' or None for a response that is the page we asked for
+    head = response.content[:MARKER_SCAN_BYTES]
+    if any(marker in head for marker in CHALLENGE_MARKERS):
+        return 'challenge'
+    head = head.lower()
+    if any(marker in head for marker in EXPIRED_MARKERS):
+        return 'expired'
+    return None
+
+
+class SessionManager:
+    # jar is the shared client's cookies: requests.Session.cookies or httpx.AsyncClient.cookies.
+    # landing_urls maps a hostname to the page a session starts from; any other host starts
+    # from its site root.
+    def __init__(self, jar, landing_urls: dict = None):
+        self.jar = jar
+        self.landing_urls = dict(landing_urls or {})
+        self.generation = {}
+        self._lock = threading.Lock()
+        self._async_lock = None
+
+    def landing_url(self, url: str) -> str:
+        parts = urlparse(url)
+        return self.landing_urls.get(parts.hostname, f'{parts.scheme}://{parts.netloc}/')
+
+    def clear(self, host: str):
+        # httpx.Cookies keeps an http.cookiejar.CookieJar in .jar; RequestsCookieJar is one
+        jar = getattr(self.jar, 'jar', self.jar)
+        for cookie in list(jar):
+            domain = cookie.domain.lstrip('.')
+            if host == domain or host.endswith(f'.{domain}'):
+                jar.clear(cookie.domain, cookie.path, cookie.name)
+
+    def _started(self, host, response):
+        problem = session_problem(response)
+        if problem is not None:
+            raise SessionError(f'could not start a session for {host}: landing page is a {problem} page')
+        self.generation[host] = self.generation.get(host, 0) + 1
+
+    def _restarting(self, host, generation, problem) -> bool:
+        # Only the first request to see a dead session replaces it
+        if self.generation.get(host) != generation:
+            return False
+        print(f'Session for {host} hit a {problem} page; starting a new one')
+        METRICS.inc('session_restarts_total', reason=problem)
+        self.clear(host)
+        return True
+
+    def _replayed(self, url, response):
+        problem = session_problem(response)
+        if problem is not None:
+            raise SessionError(f'{url} returned a {problem} page again after a new session was started')
+        return response
+
+    def get(self, get, url: str, **kwargs):
+        # get is the shared requests.Session.get (or a wrapper of it)
+        host = urlparse(url).hostname
+        landing_kwargs = {name: kwargs[name] for name in LANDING_KWARGS if name in kwargs}
+        with self._lock:
+            if host not in self.generation:
+                self._started(host, get(self.landing_url(url), **landing_kwargs))
+            generation = self.generation[host]
+        response = get(url, **kwargs)
+        problem = session_problem(response)
+        if problem is None:
+            return response
+        with self._lock:
+            if self._restarting(host, generation, problem):
+                self._started(host, get(self.landing_url(url), **landing_kwargs))
+        return self._replayed(url, get(url, **kwargs))
+
+    async def async_get(self, get, url: str, **kwargs):
+        # Same as get, for a coroutine get on the shared httpx.AsyncClient (or CrawlScheduler.fetch)
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        host = urlparse(url).hostname
+        landing_kwargs = {name: kwargs[name] for name in LANDING_KWARGS if name in kwargs}
+        async with self._async_lock:
+            if host not in self.generation:
+                self._started(host, await get(self.landing_url(url), **landing_kwargs))
+            generation = self.generation[host]
+        response = await get(url, **kwargs)
+        problem = session_problem(response)
+        if problem is None:
+            return response
+        async with self._async_lock:
+            if self._restarting(host, generation, problem):
+                self._started(host, await get(self.landing_url(url), **landing_kwargs))
+        return self._replayed(url, await get(url, **kwargs))
+
+
+def landing_urls(urls) -> dict:
+    # --landing-url values -> {hostname: url}
+    return {urlparse(url).hostname: url for url in urls}
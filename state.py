@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+def facid_from_link(link):
+    query_params = {k.lower(): v for k, v in parse_qs(urlparse(link).query).items()}
+    return query_params.get('facid', [None])[0]
+
+
+class CrawlState:
+    # facid -> eventids already scraped and written, so incremental runs only fetch new surveys
+    def __init__(self, path: str = './state.sqlite'):
+        self.path = path
+        # Read from the worker threads of surveys.py --workers, so every use of the connection holds the lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.execute('''CREATE TABLE IF NOT EXISTS surveys (
+            facid TEXT NOT NULL, eventid TEXT NOT NULL, date TEXT, scraped_at REAL,
+            PRIMARY KEY (facid, eventid))''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def known_eventids(self, facid: str) -> set:
+        with self._lock:
+            rows = self.db.execute('SELECT eventid FROM surveys WHERE facid = ?', (facid,)).fetchall()
+        return {eventid for (eventid,) in rows}
+
+    def last_scraped(self, facid: str):
+        # When this facility last had a survey written, as a timestamp (None if never)
+        with self._lock:
+            (last,) = self.db.execute('SELECT MAX(scraped_at) FROM surveys WHERE facid = ?', (facid,)).fetchone()
+        return last
+
+    def new_options(self, facid: str, options: list) -> list:
+        # Diff the SurveyList <option>s against what we already have for this facility
+        known = self.known_eventids(facid)
+        return [option for option in options if option[0] not in known]
+
+    def mark_scraped(self, facid: str, surveys: list):
+        # Only surveys whose page actually yielded data count as done; the rest are retried next run
+        now = time.time()
+        with self._lock:
+            self.db.executemany('INSERT OR REPLACE INTO surveys VALUES (?, ?, ?, ?)',
+                                [(facid, survey.eventid, survey.date_text, now)
+                                 for survey in surveys if survey.has_text])
+            self.db.commit()
+
+
+def fingerprint(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def options_fingerprint(name: str, options: list) -> str:
+    # The facility's name and the (eventid, date) options selected for this run, in page order
+    return fingerprint(json.dumps([name, options]).encode('utf-8'))
+
+
+class Fingerprints:
+    # Content hashes of what was last written: per facility, its selected SurveyList options,
+    # and per survey, its page body. A facility whose options hash the same as when all of its
+    # surveys were last written is skipped after the facility page; a survey page whose body
+    # hashes the same is neither parsed nor written again.
+    def __init__(self, path: str = './fingerprints.sqlite'):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.execute('''CREATE TABLE IF NOT EXISTS facilities (
+            facid TEXT PRIMARY KEY, options_hash TEXT NOT NULL, written_at REAL)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS pages (
+            facid TEXT NOT NULL, eventid TEXT NOT NULL, body_hash TEXT NOT NULL, written_at REAL,
+            PRIMARY KEY (facid, eventid))''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def options_unchanged(self, facid: str, options_hash: str) -> bool:
+        with self._lock:
+            row = self.db.execute('SELECT options_hash FROM facilities WHERE facid = ?', (facid,)).fetchone()
+        return row is not None and row[0] == options_hash
+
+    def page_hashes(self, facid: str) -> dict:
+        with self._lock:
+            return dict(self.db.execute('SELECT eventid, body_hash FROM pages WHERE facid = ?', (facid,)))
+
+    def mark_written(self, facid: str, facility):
+        # Page hashes of the surveys that yielded data; the options hash only once every survey
+        # selected for the facility did, so a facility with failed surveys is fetched again
+        now = time.time()
+        with self._lock:
+            self.db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                                [(facid, survey.eventid, survey.fingerprint, now)
+                                 for survey in facility.surveys if survey.has_text and survey.fingerprint])
+            if facility.fingerprint and all(survey.has_text for survey in facility.surveys):
+                self.db.execute('INSERT OR REPLACE INTO facilities VALUES (?, ?, ?)',
+                                (facid, facility.fingerprint, now))
+            self.db.commit()
+
+
+class RunJournal:
+    # One crawl's progress: the endpoints it set out to scrape and the surveys written so far.
+    # Rewritten atomically after every facility, so --resume can pick up after a crash.
+    def __init__(self, path: str = './run_journal.json'):
+        self.path = path
+        self.endpoints = []
+        self.completed = set()
+        self.surveys = {}
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def load(cls, path: str = './run_journal.json'):
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            content = json.load(f)
+        journal = cls(path)
+        journal.endpoints = content['endpoints']
+        journal.completed = set(content['completed'])
+        journal.surveys = {facid: set(eventids) for facid, eventids in content['surveys'].items()}
+        journal.started_at = content['started_at']
+        journal.finished_at = content['finished_at']
+        return journal
+
+    def resumable(self) -> bool:
+        return self.finished_at is None and bool(self.remaining())
+
+    def start(self, endpoints: list):
+        self.endpoints = list(endpoints)
+        self.completed = set()
+        self.surveys = {}
+        self.started_at = time.time()
+        self.finished_at = None
+        self.flush()
+
+    def remaining(self) -> list:
+        return [link for link in self.endpoints if facid_from_link(link) not in self.completed]
+
+    def new_options(self, facid: str, options: list) -> list:
+        # A facility cut short last time only fetches the surveys it had not written yet
+        done = self.surveys.get(facid, set())
+        return [option for option in options if option[0] not in done]
+
+    def mark_done(self, facid: str, surveys: list):
+        # Same rule as CrawlState.mark_scraped: a survey without data is not done, and
+        # neither is its facility, so a resumed run fetches it again
+        done = self.surveys.setdefault(facid, set())
+        done.update(survey.eventid for survey in surveys if survey.has_text)
+        if all(survey.has_text for survey in surveys):
+            self.completed.add(facid)
+        self.flush()
+
+    def finish(self):
+        self.finished_at = time.time()
+        self.flush()
+
+    def flush(self):
+        # Write a temporary file and swap it in, so a crash mid-write never corrupts the journal
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'endpoints': self.endpoints, 'completed': sorted(self.completed),
+                       'surveys': {facid: sorted(eventids) for facid, eventids in self.surveys.items()},
+                       'started_at': self.started_at, 'finished_at': self.finished_at}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import time
+
+from parsers import DEFICIENCY_FIELDS
+
+# Consolidated alternatives to one save_json file per facility: every survey becomes one
+# record keyed by (facid, eventid), and writing the same survey again replaces it.
+FIELDS = ('facid', 'facility', 'eventid', 'date', 'data', 'scraped_at')
+# A survey's deficiency rows travel with its record as a list of dicts; the sqlite store
+# keeps them in their own table, one row per deficiency, numbered by position (seq).
+# Records without a 'deficiencies' key (failed fetches, old archives) leave stored rows alone.
+DEFICIENCY_COLUMNS = ('facid', 'eventid', 'seq') + DEFICIENCY_FIELDS
+
+
+def survey_records(facid, facility, scraped_at=None):
+    # One row per records.Survey; the text is only decoded here, as it is written
+    scraped_at = scraped_at if scraped_at is not None else time.time()
+    for survey in facility.surveys:
+        record = {'facid': facid, 'facility': facility.name, 'eventid': survey.eventid,
+                  'date': survey.date_text, 'data': survey.text, 'scraped_at': scraped_at}
+        if survey.has_text:
+            record['deficiencies'] = survey.deficiency_dicts()
+        yield record
+
+
+class SqliteStore:
+    def __init__(self, path: str = './surveys.sqlite'):
+        self.path = path
+        # A distributed worker writes from its writer thread, one write at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS surveys (
+            facid TEXT NOT NULL, facility TEXT, eventid TEXT NOT NULL, date TEXT, data TEXT, scraped_at REAL,
+            PRIMARY KEY (facid, eventid))''')
+        self.db.execute(f'''CREATE TABLE IF NOT EXISTS deficiencies (
+            {', '.join(f'{column} TEXT' for column in DEFICIENCY_COLUMNS if column != 'seq')}, seq INTEGER,
+            PRIMARY KEY (facid, eventid, seq))''')
+        # Text of each survey's Statement of Deficiencies PDF (pdfs.py), one row per page, and
+        # one pdf_documents row once every page of it has been written
+        self.db.execute('''CREATE TABLE IF NOT EXISTS pdf_pages (
+            facid TEXT NOT NULL, eventid TEXT NOT NULL, page INTEGER NOT NULL, text TEXT,
+            PRIMARY KEY (facid, eventid, page))''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS pdf_documents (
+            facid TEXT NOT NULL, eventid TEXT NOT NULL, pages INTEGER, extracted_at REAL,
+            PRIMARY KEY (facid, eventid))''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def write_records(self, records):
+        # A failed survey page (data None) never overwrites text we already have
+        self.db.executemany('''INSERT INTO surveys VALUES (:facid, :facility, :eventid, :date, :data, :scraped_at)
+            ON CONFLICT (facid, eventid) DO UPDATE SET
+                facility = excluded.facility, date = excluded.date,
+                data = COALESCE(excluded.data, surveys.data), scraped_at = excluded.scraped_at''', records)
+        for record in records:
+            if record.get('deficiencies') is None:
+                continue
+            key = (record['facid'], record['eventid'])
+            self.db.execute('DELETE FROM deficiencies WHERE facid = ? AND eventid = ?', key)
+            self.db.executemany(
+                f'INSERT INTO deficiencies ({", ".join(DEFICIENCY_COLUMNS)}) '
+                f'VALUES ({", ".join("?" * len(DEFICIENCY_COLUMNS))})',
+                [key + (seq,) + tuple(row[field] for field in DEFICIENCY_FIELDS)
+                 for seq, row in enumerate(record['deficiencies'])])
+        self.db.commit()
+
+    def write(self, facid, facility):
+        self.write_records(list(survey_records(facid, facility)))
+
+    def facids(self):
+        # facility name -> facid for everything the scrapers have written
+        return dict(self.db.execute("SELECT facility, facid FROM surveys WHERE facid != '' GROUP BY facility"))
+
+    def survey_keys(self, skip_extracted: bool = False):
+        # (facid, eventid) of every survey written with data; skip_extracted leaves out those
+        # whose PDF text is already complete
+        query = "SELECT facid, eventid FROM surveys WHERE facid != '' AND data IS NOT NULL"
+        if skip_extracted:
+            query += (' AND NOT EXISTS (SELECT 1 FROM pdf_documents d'
+                      ' WHERE d.facid = surveys.facid AND d.eventid = surveys.eventid)')
+        return self.db.execute(query + ' ORDER BY facid, eventid').fetchall()
+
+    def write_pdf_pages(self, facid, eventid, pages, page_count=None):
+        # pages is [(page number, text)]; page_count marks the document complete
+        self.db.executemany('INSERT OR REPLACE INTO pdf_pages VALUES (?, ?, ?, ?)',
+                            [(facid, eventid, page, text) for page, text in pages])
+        if page_count is not None:
+            self.db.execute('INSERT OR REPLACE INTO pdf_documents VALUES (?, ?, ?, ?)',
+                            (facid, eventid, page_count, time.time()))
+        self.db.commit()
+
+    def iter_surveys(self, deficiencies: bool = False):
+        cursor = self.db.execute(f'SELECT {", ".join(FIELDS)} FROM surveys ORDER BY facid, eventid')
+        rows = self._iter_deficiencies() if deficiencies else iter(())
+        pending = next(rows, None)
+        for row in cursor:
+            record = dict(zip(FIELDS, row))
+            if deficiencies:
+                # Both cursors run in (facid, eventid) order, so the rows are merged in one pass
+                key = (record['facid'], record['eventid'])
+                found = []
+                while pending is not None and pending[0] <= key:
+                    if pending[0] == key:
+                        found.append(pending[1])
+                    pending = next(rows, None)
+                record['deficiencies'] = found or None
+            yield record
+
+    def _iter_deficiencies(self):
+        cursor = self.db.execute(f'SELECT {", ".join(DEFICIENCY_COLUMNS)} FROM deficiencies '
+                                 'ORDER BY facid, eventid, seq')
+        for row in cursor:
+            yield (row[0], row[1]), dict(zip(DEFICIENCY_FIELDS, row[3:]))
+
+
+class JsonlStore:
+    # Append-only JSON Lines. A survey written again is appended and the newest line wins on
+    # read; compact() rewrites the file with only the winners.
+    def __init__(self, path: str = './surveys.jsonl'):
+        self.path = path
+        self.latest = {}
+        if os.path.exists(path):
+            for key, offset, record in self._scan():
+                self.latest[key] = (offset, record.get('data') is not None)
+        self.f = open(path, 'ab')
+
+    def close(self):
+        self.f.close()
+
+    def _scan(self):
+        with open(self.path, 'rb') as f:
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                if line.strip():
+                    record = json.loads(line)
+                    yield (record['facid'], record['eventid']), offset, record
+                offset = f.tell()
+
+    def write_records(self, records):
+        for record in records:
+            key = (record['facid'], record['eventid'])
+            # Same reasoning as SqliteStore: don't let a failed fetch shadow stored text
+            if record.get('data') is None and self.latest.get(key, (None, False))[1]:
+                continue
+            offset = self.f.tell()
+            self.f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.latest[key] = (offset, record.get('data') is not None)
+        self.f.flush()
+
+    def write(self, facid, facility):
+        self.write_records(survey_records(facid, facility))
+
+    def iter_surveys(self, deficiencies: bool = False):
+        # One sequential pass; only lines that are still the latest for their key are yielded.
+        # Records carry their deficiencies as written; they are dropped unless asked for.
+        self.f.flush()
+        winners = {offset for offset, _ in self.latest.values()}
+        with open(self.path, 'rb') as f:
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                if offset in winners:
+                    record = json.loads(line)
+                    if not deficiencies:
+                        record.pop('deficiencies', None)
+                    yield record
+                offset = f.tell()
+
+    def facids(self):
+        return {record['facility']: record['facid'] for record in self.iter_surveys() if record['facid']}
+
+    def compact(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as out:
+            for record in self.iter_surveys(deficiencies=True):
+                out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.f.close()
+        os.replace(tmp_path, self.path)
+        self.latest = {}
+        for key, offset, record in self._scan():
+            self.latest[key] = (offset, record.get('data') is not None)
+        self.f = open(self.path, 'ab')
+
+
+SINKS = ('json', 'jsonl', 'sqlite', 'parquet')
+
+
+def open_store(sink: str, path: str = None):
+    # 'json' keeps the original one-file-per-facility save_json output and returns None
+    if sink == 'json':
+        return None
+    if sink == 'jsonl':
+        return JsonlStore(path or './surveys.jsonl')
+    if sink == 'sqlite':
+        return SqliteStore(path or './surveys.sqlite')
+    if sink == 'parquet':
+        # export.py needs pyarrow, which is optional
+        from export import ParquetStore
+        return ParquetStore(path or './surveys_parquet')
+    raise ValueError(f"Unknown sink {sink!r}, expected one of {SINKS}")
@@ -0,0 +1,144 @@
+import functools
+from array import array
+from datetime import date, datetime
+
+try:
+    import numpy
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+# A facility's SurveyList <option>s as columns: eventids, the date text as posted, and the
+# date as a day number (date.toordinal(), UNPARSED when the text is not M/D/YYYY). Year,
+# date-range and since-last-scrape predicates then run over the whole day column at once,
+# with NumPy when it is installed and a plain array otherwise, replacing the per-option
+# strptime loop of filter_surveys_by_year.
+UNPARSED = -1
+DEFAULT_YEARS = (2023, 2024)
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_day(text: str) -> int:
+    # The same posting dates repeat across thousands of facilities, so each is parsed once
+    try:
+        month, day, year = text.split('/')
+        return date(int(year), int(month), int(day)).toordinal()
+    except ValueError:
+        return UNPARSED
+
+
+def parse_date_arg(text: str) -> int:
+    # --from/--to values: YYYY-MM-DD or M/D/YYYY
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').toordinal()
+    except ValueError:
+        day = parse_day(text)
+        if day == UNPARSED:
+            raise ValueError(f"Can't parse date {text!r}, expected YYYY-MM-DD or M/D/YYYY")
+        return day
+
+
+def year_bounds(year: int):
+    return date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()
+
+
+class SurveyList:
+    __slots__ = ('eventids', 'texts', 'days', 'unparsed')
+
+    def __init__(self, eventids: list, texts: list, days):
+        self.eventids = eventids
+        self.texts = texts
+        self.days = days
+        self.unparsed = sum(1 for day in days if day == UNPARSED)
+
+    @classmethod
+    def from_options(cls, options):
+        # The '-- Select a Survey --' placeholder has no eventid and is dropped here
+        options = [option for option in options if option[0]]
+        eventids = [eventid for eventid, _ in options]
+        texts = [text for _, text in options]
+        days = [parse_day(text) for text in texts]
+        if HAVE_NUMPY:
+            return cls(eventids, texts, numpy.array(days, dtype=numpy.int64))
+        return cls(eventids, texts, array('q', days))
+
+    def __len__(self):
+        return len(self.eventids)
+
+    def options(self, mask=None) -> list:
+        # Back to [(eventid, date text)], keeping only the rows where mask is true
+        if mask is None:
+            return list(zip(self.eventids, self.texts))
+        if HAVE_NUMPY:
+            return [(self.eventids[i], self.texts[i]) for i in numpy.flatnonzero(mask)]
+        return [option for option, keep in zip(zip(self.eventids, self.texts), mask) if keep]
+
+    def between(self, start: int = None, end: int = None):
+        # Dated on or after start and on or before end (day numbers, either may be None)
+        start = 0 if start is None else start
+        end = date.max.toordinal() if end is None else end
+        if HAVE_NUMPY:
+            return (self.days >= start) & (self.days <= end)
+        return [start <= day <= end for day in self.days]
+
+    def in_years(self, years):
+        bounds = [year_bounds(year) for year in years]
+        if HAVE_NUMPY:
+            mask = numpy.zeros(len(self.days), dtype=bool)
+            for start, end in bounds:
+                mask |= (self.days >= start) & (self.days <= end)
+            return mask
+        return [any(start <= day <= end for start, end in bounds) for day in self.days]
+
+
+def combine(*masks):
+    # AND of the given masks, ignoring any that are None
+    masks = [mask for mask in masks if mask is not None]
+    if not masks:
+        return None
+    if HAVE_NUMPY:
+        return functools.reduce(numpy.logical_and, masks)
+    return [all(keep) for keep in zip(*masks)]
+
+
+class SurveyFilter:
+    # Which SurveyList options scrape_pages fetches: posted in one of years (None for any year),
+    # dated within [start, end], and with since_last_scrape, dated on or after the day the
+    # facility was last scraped according to the CrawlState
+    def __init__(self, years=DEFAULT_YEARS, start: int = None, end: int = None, since_last_scrape: bool = False):
+        self.years = tuple(years) if years else None
+        self.start = start
+        self.end = end
+        self.since_last_scrape = since_last_scrape
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(years=args.years, start=parse_date_arg(args.date_from) if args.date_from else None,
+                   end=parse_date_arg(args.date_to) if args.date_to else None,
+                   since_last_scrape=args.since_last_scrape)
+
+    def apply(self, facid: str, options: list, state=None) -> list:
+        surveys = SurveyList.from_options(options)
+        if surveys.unparsed:
+            print(f"Skipping {surveys.unparsed} survey option(s) with unparsable dates for facid {facid}")
+        since = None
+        if self.since_last_scrape and state is not None:
+            last = state.last_scraped(facid)
+            if last is not None:
+                since = date.fromtimestamp(last).toordinal()
+        mask = combine(surveys.in_years(self.years) if self.years else None,
+                       surveys.between(self.start, self.end) if self.start or self.end else None,
+                       surveys.between(since) if since is not None else None)
+        if mask is None:
+            # No date predicate at all still drops options whose date can't be read
+            mask = surveys.between()
+        return surveys.options(mask)
+
+
+def add_filter_args(parser):
+    parser.add_argument('--years', type=int, nargs='*', default=list(DEFAULT_YEARS),
+                        help='only scrape surveys dated in these years (default: 2023 2024; no values for any year)')
+    parser.add_argument('--from', dest='date_from', help='only scrape surveys dated on or after YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', help='only scrape surveys dated on or before YYYY-MM-DD')
+    parser.add_argument('--since-last-scrape', action='store_true',
+                        help='only scrape surveys dated on or after the facility\'s last scrape (implies --incremental)')
@@ -1,11 +1,32 @@
 import os
-from datetime import datetime
+import argparse
 import requests
-from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup, NavigableString
+from requests.adapters import HTTPAdapter
 import json
 import csv
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from cache import ResponseCache, cached_get
+from discovery import daac_urls, dedupe_by_facid
+from fetch import CircuitOpenError, DeadLetters, Fetcher, replay_endpoints
+from metrics import METRICS, MetricsExporter, record_response
+from pools import ordered_map
+from state import CrawlState, Fingerprints, RunJournal, facid_from_link, fingerprint, options_fingerprint
+from store import SINKS, open_store
+from surveylist import SurveyFilter, add_filter_args
+from records import Facility, Survey
+from search import SearchIndex
+from session import SessionError, SessionManager, landing_urls
+from parsers import BACKENDS, DEFAULT_BACKEND, check_backend, parse_facility_page, parse_index_links, parse_survey_page
+
+# Overridable so bench/run_bench.py can point the scraper at a local stand-in server
+BASE_URL = 'https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/'
+DAAC_URL = 'https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx'
+# (connect, read) seconds, matching async_surveys.create_client; without one a stalled
+# response would hang the run instead of being retried
+REQUEST_TIMEOUT = (10.0, 30.0)
 
 def save_csv(data):
     fieldnames = ['eventid', 'date', 'data']
@@ -21,9 +42,9 @@ def save_csv(data):
         for survey in data:
             writer.writerow(survey)
             
-def save_json(data):
+def save_json(facility: Facility):
     os.makedirs('./json', exist_ok=True)
-    facility_name = data['facility'].replace(' ', '_').replace('/', '-').replace('<br>', '')
+    facility_name = facility.name.replace(' ', '_').replace('/', '-').replace('<br>', '')
     
     # Start with the base filename, assuming no number appended
     filename = f'survey_{facility_name}'
@@ -36,12 +57,11 @@ def save_json(data):
         file_path = f'./json/{filename}.{counter}{file_extension}'
         
     with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        json.dump(facility.to_dict(), f, ensure_ascii=False, indent=4)
     
     print(f' Data has been written to {file_path}.')
             
-def get_endpoints(links):
-    uri = 'https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/'
+def get_endpoints(links, uri=BASE_URL):
     endpoints = [link.replace(uri, '') for link in links]
     return endpoints
 
@@ -53,104 +73,225 @@ def contains_m(text):
     text_lower = text.lower()
     return any(char in text_lower for char in ['m'])
 
-def get_links(url, headers):
+def create_session(pool_size: int = 10) -> requests.Session:
+    # The run's shared session. Its connection pool per host is sized to the threads that can
+    # be fetching at once; requests' default keeps 10 and opens (then drops) extra connections.
+    client = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    client.mount('https://', adapter)
+    client.mount('http://', adapter)
+    return client
+
+def get_page(url, headers=None, cookies=None, data=None, cache=None, fetcher=None, client=None):
+    # client is the run's shared requests.Session, which holds the site's session cookies
+    get = client.get if client is not None else requests.get
+    if fetcher is not None:
+        get = functools.partial(fetcher.get, get)
+    start = time.perf_counter()
+    if cache is not None:
+        response = cached_get(cache, url, get, headers=headers, cookies=cookies, data=data, timeout=REQUEST_TIMEOUT)
+    else:
+        response = get(url, headers=headers, cookies=cookies, data=data, timeout=REQUEST_TIMEOUT)
+    seconds = time.perf_counter() - start
+    record_response(METRICS, response, seconds)
+    if not getattr(response, 'from_cache', False):
+        # requests has no per-stage hooks; elapsed runs from sending the request to parsing the
+        # headers, so it stands in for time to first byte and the rest is the body download
+        METRICS.observe('http_ttfb_seconds', response.elapsed.total_seconds())
+        METRICS.observe('http_download_seconds', max(0.0, seconds - response.elapsed.total_seconds()))
+    return response
+
+def run_parser(func, *args):
+    with METRICS.timer('parse_seconds', page=func.__name__):
+        return func(*args)
+
+def get_links(url, headers, cache=None, parser=DEFAULT_BACKEND, fetcher=None, client=None):
     # url = f'https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx'
-    page = requests.get(url, headers)
-    soup = BeautifulSoup(page.content, "html.parser")
-    content_container = soup.find('div', class_='content-container')
-    table = content_container.find('table')
-    rows =  table.find_all('tr')
-
-    filtered_rows = [row for row in rows if len(row.find_all('td')) >= 4 and contains_m(row.find_all('td')[3].text)]
-    # links = [[cell for cell in row.find_all('td')[1]] for row in filterd_rows]
-    urls = [cell.find('a')['href'] for row in filtered_rows for cell in row.find_all('td', limit=2) if cell.find('a')]
+    # The headers are built for sais.health.pa.gov; the DAAC index lives on apps.health.pa.gov
+    index_headers = {k: v for k, v in headers.items() if k not in ('Host', 'Cookie')}
+    page = get_page(url, headers=index_headers, cache=cache, fetcher=fetcher, client=client)
+    urls = run_parser(parse_index_links, page.content, contains_m, parser)
     
     return urls
 
-def scrape_pages(link, headers, cookies, data):
-    base_url = "https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/"
-    parsed_url = urlparse(link)
-    # Parse the query parameters from the URL
-    query_params = parse_qs(parsed_url.query)
-    
-    # Extract the 'Facid' value
-    facid = query_params.get('Facid', [None])[0]
+def discover_endpoints(urls, headers, cache=None, parser=DEFAULT_BACKEND, fetcher=None, base_url=BASE_URL,
+                       workers=4, client=None):
+    # Index pages are fetched in parallel; the endpoints are merged in url order, one per facid
+    def fetch_links(url):
+        try:
+            return get_links(url, headers, cache=cache, parser=parser, fetcher=fetcher, client=client)
+        except (requests.RequestException, CircuitOpenError, SessionError) as e:
+            print(f"Failed to fetch index {url}: {e!r}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+        links = [link for page_links in executor.map(fetch_links, urls) for link in page_links]
+    return dedupe_by_facid(get_endpoints(links, uri=base_url))
+
+def scrape_pages(link, headers, cookies, data, cache=None, state=None, parser=DEFAULT_BACKEND,
+                 base_url=BASE_URL, fetcher=None, journal=None, survey_filter=None, client=None,
+                 fingerprints=None, executor=None):
+    # Extract the facid value; index pages link with Facid= or facid=
+    facid = facid_from_link(link)
     if not facid:
         print("Facid not found in the link.")
         return None
     
     initial_page_url = f"{base_url}{link}"
-    response = requests.get(initial_page_url, headers=headers, cookies=cookies)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    select_element = soup.find('select', id='SurveyList')
+    response = get_page(initial_page_url, headers=headers, cookies=cookies, cache=cache, fetcher=fetcher,
+                        client=client)
+    if response.status_code != 200:
+        print(f"Failed to fetch {initial_page_url}: HTTP {response.status_code}")
+        return None
+    facility_name, options = run_parser(parse_facility_page, response.content, parser)
     
-    all_survey_data = {}
-    survey_data = []
+    if options is None:
+        # An error or maintenance page served as 200; returning None leaves the facility
+        # unfinished, so --resume, --incremental or a distributed worker tries it again
+        print(f"Couldn't find the survey list dropdown on {initial_page_url}")
+        if cache is not None:
+            cache.discard(initial_page_url)
+        return None
+    facility = Facility(facid, facility_name)
     
-    facility_name_tag = soup.find('font', {'size': '+1'})
-    facility_name = ''
+    options = (survey_filter or SurveyFilter()).apply(facid, options, state)
+    if fingerprints is not None:
+        facility.fingerprint = options_fingerprint(facility_name, options)
+        if fingerprints.options_unchanged(facid, facility.fingerprint):
+            METRICS.inc('unchanged_total', page='facility')
+            return facility
+        known_pages = fingerprints.page_hashes(facid)
+    if state is not None:
+        options = state.new_options(facid, options)
+    if journal is not None:
+        options = journal.new_options(facid, options)
     
-    if facility_name_tag:
-        for content in facility_name_tag.contents:
-            if isinstance(content, NavigableString):
-                facility_name = content.strip()
-                break
-            
-    all_survey_data['facility'] = facility_name       
+    def survey_url(eventid):
+        return f"{base_url}ltc-survey.asp?facid={facid}&page=1&name=&SurveyType=H&eventid={eventid}"
+
+    def fetch_survey(eventid):
+        return get_page(survey_url(eventid), headers=headers, cookies=cookies, data=data, cache=cache,
+                        fetcher=fetcher, client=client)
     
-    if not select_element:
-        print("Couldn't find the survey list dropdown.")
-        return {'facility': '', 'data': []}
+    # With an executor every eventid page is requested at once and parsed here as each arrives, in order
+    if executor is not None:
+        pending = [executor.submit(fetch_survey, eventid) for eventid, _ in options]
+    for index, (eventid, date_txt) in enumerate(options):
+        # DEBUG print(f"Processing {date_txt} with eventid {eventid}") 
+        try:
+            if executor is not None:
+                survey_response = pending[index].result()
+            else:
+                survey_response = fetch_survey(eventid)
+        except (requests.RequestException, CircuitOpenError, SessionError) as e:
+            # Left without data, so --incremental or --replay picks it up again
+            print(f"Failed to fetch eventid {eventid}: {e!r}")
+            facility.surveys.append(Survey(eventid, date_txt))
+            continue
+        body_hash = None
+        if fingerprints is not None:
+            body_hash = fingerprint(survey_response.content)
+            if known_pages.get(eventid) == body_hash:
+                METRICS.inc('unchanged_total', page='survey')
+                continue
+        survey_text, deficiencies = run_parser(parse_survey_page, survey_response.content, parser)
+        if survey_text is None and cache is not None:
+            # No survey layout (an error or maintenance page served as 200): not kept in the cache
+            cache.discard(survey_url(eventid))
+        facility.surveys.append(Survey(eventid, date_txt, survey_text, deficiencies, body_hash))
     
-    if select_element:
-        options = select_element.find_all('option')
-        options = filter_surveys_by_year(options)
-        
-        for option in options:
-            eventid = option['value']
-            date_txt = option.text.strip()
-            # DEBUG print(f"Processing {date_txt} with eventid {eventid}") 
-            survey_details = {'eventid': eventid, 'date': date_txt}
-            
-            survey_url = f"{base_url}ltc-survey.asp?facid={facid}&page=1&name=&SurveyType=H&eventid={eventid}" 
-            survey_response = requests.get(survey_url, headers=headers, cookies=cookies, data=data)
-            soup = BeautifulSoup(survey_response.content, 'html.parser')
-            tables = soup.findAll('table')
-            
-            if len(tables) >= 5:
-                data_tables = tables[5:-1]
-                survey_details['data'] = ' '.join([table.text.strip() for table in data_tables])            
-            survey_data.append(survey_details)
-        all_survey_data['data'] = survey_data
-        
-        return all_survey_data  
-    else:
-        print("Couldn't find the survey list dropdown.")
+    return facility
+
+def write_result(link, result, state=None, store=None, search_index=None, journal=None, fingerprints=None):
+    if isinstance(result, Exception):
+        print(f"Failed to scrape {link}: {result!r}")
+        return
+    if result is None:
+        print(f"No data to save for link: {link}")
+        return
+    # An incremental run, or one skipping unchanged pages, with nothing new for this facility
+    # has nothing to write
+    if (state is None and fingerprints is None) or result.surveys:
+        with METRICS.timer('write_seconds', sink=type(store).__name__ if store is not None else 'json'):
+            if store is not None:
+                store.write(facid_from_link(link), result)
+            else:
+                save_json(result)
+        METRICS.inc('facilities_written_total')
+        METRICS.inc('surveys_written_total', len(result.surveys))
+        if search_index is not None:
+            search_index.write(facid_from_link(link), result)
+        if state is not None:
+            state.mark_scraped(facid_from_link(link), result.surveys)
+    if fingerprints is not None:
+        fingerprints.mark_written(facid_from_link(link), result)
+    if journal is not None:
+        journal.mark_done(facid_from_link(link), result.surveys)
 
-def filter_surveys_by_year(options, years=[2023, 2024]):
-    filtered_options = []
-    for option in options:
-        date_text = option.text.strip()
+def run_app(endpoints, headers, cookies, data, cache=None, state=None, parser=DEFAULT_BACKEND, store=None,
+            search_index=None, base_url=BASE_URL, fetcher=None, journal=None, survey_filter=None, client=None,
+            fingerprints=None, workers=1):
+    # workers > 1 scrapes that many facilities at once, each fetching its eventid pages on a
+    # second pool of the same size (a facility thread waiting on its pages never holds up the
+    # pages themselves). Results are still written here, one at a time and in endpoint order.
+    def scrape(link, executor=None):
         try:
-            survey_date = datetime.strptime(date_text, "%m/%d/%Y")
-            if survey_date.year in years:
-                filtered_options.append(option)
-                # DEBUG print(f"Filtered Dates: Complete {filtered_options}")
-        except ValueError:
-            # Handle date format does not match or parsing fails
-            print(f"Error parsing date for option: {date_text}")
-    return filtered_options
-
-def run_app(endpoints, headers, cookies, data):
-    for link in tqdm(endpoints, desc="Scraping Progress", unit="link"):
-        data = scrape_pages(link, headers, cookies, data)
-        if data is not None: 
-            save_json(data)
-        else:
-            print(f"No data to save for link: {link}")
- 
+            return scrape_pages(link, headers, cookies, data, cache=cache, state=state, parser=parser,
+                                base_url=base_url, fetcher=fetcher, journal=journal, survey_filter=survey_filter,
+                                client=client, fingerprints=fingerprints, executor=executor)
+        except (requests.RequestException, CircuitOpenError, SessionError) as e:
+            return e
+
+    def write_all(results):
+        for link, result in tqdm(zip(endpoints, results), total=len(endpoints), desc="Scraping Progress", unit="link"):
+            write_result(link, result, state, store, search_index, journal, fingerprints)
+
+    if workers <= 1:
+        write_all(map(scrape, endpoints))
+        return
+    with ThreadPoolExecutor(max_workers=workers) as facility_pool, ThreadPoolExecutor(max_workers=workers) as pages:
+        write_all(ordered_map(facility_pool, functools.partial(scrape, executor=pages), endpoints, 2 * workers))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scrape PA DOH facility surveys.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch and save eventids not already recorded in the state store')
+    parser.add_argument('--state', default='./state.sqlite', help='state store used by --incremental')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='facilities scraped at once, each fetching its survey pages in parallel (default: 1)')
+    parser.add_argument('--fingerprints', help='skip facilities and survey pages unchanged since they were last '
+                                               'written, keeping content hashes in this SQLite file')
+    add_filter_args(parser)
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=BACKENDS, help='HTML parsing backend')
+    parser.add_argument('--no-cache', action='store_true', help='fetch every page from the site, without ./cache')
+    parser.add_argument('--sink', default='json', choices=SINKS,
+                        help='json: one file per facility; jsonl/sqlite: one consolidated store, upserted by (facid, eventid)')
+    parser.add_argument('--output', help='path of the jsonl/sqlite store')
+    parser.add_argument('--index', help='also add saved surveys to this full-text search index (see search.py)')
+    parser.add_argument('--retries', type=int, default=4, help='attempts per page before it is dead-lettered')
+    parser.add_argument('--dead-letters', default='./dead_letters.jsonl', help='where pages that kept failing are listed')
+    parser.add_argument('--replay', action='store_true',
+                        help='scrape the facilities listed in --dead-letters instead of the DAAC index')
+    parser.add_argument('--months', help='DAAC index months to read, YYYYMM or YYYYMM:YYYYMM (default: 202402)')
+    parser.add_argument('--daac-url', action='append', help='another posted-surveys list to read (repeatable)')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='address the metrics port listens on (0.0.0.0: every interface)')
+    parser.add_argument('--metrics-json', help='write a JSON metrics snapshot to this file every --metrics-interval')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='seconds between JSON snapshots')
+    parser.add_argument('--landing-url', action='append', default=[],
+                        help='page a new site session starts from, per host (default: the site root)')
+    parser.add_argument('--journal', default='./run_journal.json', help='progress journal written during every run')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the unfinished run in --journal instead of starting over')
+    args = parser.parse_args()
+    check_backend(args.parser)
+    # The last scrape of each facility is read from the state store
+    args.incremental = args.incremental or args.since_last_scrape
+    return args
+
 def main():
-    
+    args = parse_args()
     links = []     
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
@@ -158,7 +299,6 @@ def main():
         'Accept-Language': 'en-US,en;q=0.9',
         'Cache-Control': 'max-age=0',
         'Connection': 'keep-alive',
-        'Cookie': '_ga_43SYEQBLV4=GS1.1.1701298993.1.1.1701299170.0.0.0; _ga_Y97KNG0WT3=GS1.1.1702655416.2.0.1702655416.0.0.0; _ga_EFBFYET3JS=GS1.1.1705532227.1.1.1705532239.0.0.0; visid_incap_2815744=xjCHti1DRE+C+DecvMgYa1NbqGUAAAAAQUIPAAAAAABnHMKnuYDw6XcK4WUnuxn1; _ga_5ETEHW2RE7=GS1.1.1705532245.1.0.1705532250.0.0.0; _ga_45SCT2E2LM=GS1.2.1710243958.6.0.1710243958.60.0.0; _ga_EVYRH4J3SP=GS1.1.1710697627.53.0.1710697627.0.0.0; _ga_P7HXBG8L73=GS1.1.1710697627.55.0.1710697627.0.0.0; _ga=GA1.2.308807853.1701298993; ASP.NET_SessionId=oi0sjzi5oclme01dztvbmda0; _gid=GA1.2.2087917036.1710934762; _ga_J4ZD36GZ4Z=GS1.2.1710934762.53.0.1710934762.60.0.0; ASPSESSIONIDSGCSTSCC=PBIMPPOAMDCLMMKCAGDCMGJD; cookiesession1=678B289230A0F4DA773BAF428CBD4812',
         'Host': 'sais.health.pa.gov',
         'Referer': 'https://sais.health.pa.gov/',
         'Sec-Ch-Ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
@@ -172,34 +312,53 @@ def main():
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
     }
     
-    cookies = {
-        '_ga_43SYEQBLV4': 'GS1.1.1701298993.1.1.1701299170.0.0.0',
-        '_ga_Y97KNG0WT3': 'GS1.1.1702655416.2.0.1702655416.0.0.0',
-        '_ga_EFBFYET3JS': 'GS1.1.1705532227.1.1.1705532239.0.0.0',
-        'visid_incap_2815744': 'xjCHti1DRE+C+DecvMgYa1NbqGUAAAAAQUIPAAAAAABnHMKnuYDw6XcK4WUnuxn1',
-        '_ga_5ETEHW2RE7': 'GS1.1.1705532245.1.0.1705532250.0.0.0',
-        '_ga_45SCT2E2LM': 'GS1.2.1710243958.6.0.1710243958.60.0.0',
-        '_ga_EVYRH4J3SP': 'GS1.1.1710697627.53.0.1710697627.0.0.0',
-        '_ga_P7HXBG8L73': 'GS1.1.1710697627.55.0.1710697627.0.0.0',
-        '_ga': 'GA1.2.308807853.1701298993',
-        'ASP.NET_SessionId': 'oi0sjzi5oclme01dztvbmda0',
-        '_gid': 'GA1.2.2087917036.1710934762',
-        '_ga_J4ZD36GZ4Z': 'GS1.2.1710934762.53.0.1710934762.60.0.0',
-        'ASPSESSIONIDSGCSTSCC': 'PBIMPPOAMDCLMMKCAGDCMGJD',
-        'cookiesession1': '678B289230A0F4DA773BAF428CBD4812',
-    }
+    # Finalized survey pages are served from ./cache on re-runs; only new eventids hit the site
+    cache = None if args.no_cache else ResponseCache('./cache')
     
-    data = {
-        'csrf_token': '{481D89AA-A17F-4BBE-96B3-C9EE3BBBB2DF}',
-    }
-    
-    main_page_url = 'https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx'
-    links = get_links(url=main_page_url, headers=headers)
-    unique_list = list(set(links))    
-    endpoints = get_endpoints(unique_list)
+    exporter = MetricsExporter(METRICS, args.metrics_port, args.metrics_json, args.metrics_interval,
+                               args.metrics_host).start()
+    replayed = DeadLetters.load(args.dead_letters) if args.replay else None
+    # One pooled session for the run; its cookie jar holds the site session the manager starts.
+    # Facility and survey page threads can each hold a connection.
+    client = create_session(pool_size=max(10, 2 * args.workers))
+    fetcher = Fetcher(attempts=args.retries, dead_letters=DeadLetters(args.dead_letters),
+                      session=SessionManager(client.cookies, landing_urls(args.landing_url)))
+    journal = RunJournal.load(args.journal) if args.resume else None
+    if journal is not None and journal.resumable():
+        endpoints = journal.remaining()
+        print(f'Resuming run: {len(endpoints)} of {len(journal.endpoints)} facilities left')
+    else:
+        if replayed is not None:
+            endpoints = replay_endpoints(replayed)
+        else:
+            endpoints = discover_endpoints(daac_urls(args.months, args.daac_url, DAAC_URL), headers, cache=cache,
+                                           parser=args.parser, fetcher=fetcher, client=client)
+        journal = RunJournal(args.journal)
+        journal.start(endpoints)
     # print(f'{endpoints}')
     
-    run_app(endpoints, headers, cookies, data)
+    state = CrawlState(args.state) if args.incremental else None
+    store = open_store(args.sink, args.output)
+    search_index = SearchIndex(args.index) if args.index else None
+    fingerprints = Fingerprints(args.fingerprints) if args.fingerprints else None
+    run_app(endpoints, headers, None, None, cache=cache, state=state, parser=args.parser, store=store,
+            search_index=search_index, fetcher=fetcher, journal=journal, survey_filter=SurveyFilter.from_args(args),
+            client=client, fingerprints=fingerprints, workers=args.workers)
+    journal.finish()
+    client.close()
+    if cache is not None:
+        cache.close()
+    fetcher.dead_letters.close()
+    if state is not None:
+        state.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    if store is not None:
+        store.close()
+    if search_index is not None:
+        search_index.close()
+    exporter.close()
+    print(METRICS.summary())
     
             
 if __name__ == '__main__':
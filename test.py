@@ -1,25 +1,41 @@
 from datetime import datetime
 import os
+import argparse
 import json
 import time
-from urllib.parse import parse_qs, urlparse
 import httpx
 import asyncio
-from bs4 import BeautifulSoup, NavigableString
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from scheduler import CrawlScheduler
+from cache import ResponseCache, async_cached_get
+from discovery import daac_urls, dedupe_by_facid
+from fetch import CircuitOpenError, DeadLetters, Fetcher, replay_endpoints
+from metrics import METRICS, MetricsExporter, RequestTrace, record_response
+from state import CrawlState, Fingerprints, RunJournal, facid_from_link, fingerprint, options_fingerprint
+from store import SINKS, open_store
+from surveylist import SurveyFilter, add_filter_args
+from records import Facility, Survey
+from search import SearchIndex
+from session import SessionError, SessionManager, landing_urls
+from parsers import BACKENDS, DEFAULT_BACKEND, check_backend, parse_facility_page, parse_index_links, parse_survey_page
+
+# Overridable so bench/run_bench.py can point the scraper at a local stand-in server
+BASE_URL = 'https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/'
+DAAC_URL = 'https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx'
 
 def contains_adm(text):
     text_lower = text.lower()
     return any(char in text_lower for char in ['a', 'd', 'm', '3'])
 
-def get_endpoints(links):
-    uri = 'https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/'
+def get_endpoints(links, uri=BASE_URL):
     endpoints = [link.replace(uri, '') for link in links]
     return endpoints
 
-def save_json(data):
+def save_json(facility: Facility):
     os.makedirs('./json', exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d")
-    facility_name = data['facility'].replace(' ', '_').replace('/', '-').replace('<br>', '')
+    facility_name = facility.name.replace(' ', '_').replace('/', '-').replace('<br>', '')
 
     filename = f'{timestamp}_survey_{facility_name}'
     file_extension = '.json'
@@ -31,126 +47,281 @@ def save_json(data):
         file_path = f'./json/{filename}.{counter}{file_extension}'
         
     with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        json.dump(facility.to_dict(), f, ensure_ascii=False, indent=4)
     
     print(f' Data has been written to {file_path}.')
 
-def filter_surveys_by_year(options, years=[2023, 2024]):
-    filtered_options = []
-    for option in options:
-        date_text = option.text.strip()
+def create_client(cookies: dict = None, max_connections: int = 20, max_keepalive_connections: int = 10,
+                  keepalive_expiry: float = 30.0, http2: bool = True):
+    # One long-lived client per run so facility and eventid pages reuse pooled connections
+    if http2:
         try:
-            survey_date = datetime.strptime(date_text, "%m/%d/%Y")
-            if survey_date.year in years:
-                filtered_options.append(option)
-                # DEBUG print(f"Filtered Dates: Complete {filtered_options}")
-        except ValueError:
-            # Handle date format does not match or parsing fails
-            print(f"Error parsing date for option: {date_text}")
-    return filtered_options
-
-async def fetch_page(url: str, headers: dict = None, cookies: dict = None, params: dict= None):
+            import h2  # noqa: F401 -- httpx only speaks HTTP/2 when the h2 extra is installed
+        except ImportError:
+            http2 = False
+    limits = httpx.Limits(max_connections=max_connections,
+                          max_keepalive_connections=max_keepalive_connections,
+                          keepalive_expiry=keepalive_expiry)
     timeout = httpx.Timeout(10.0, read=30.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.get(url, headers=headers, cookies=cookies)
-        return response
+    return httpx.AsyncClient(cookies=cookies, limits=limits, timeout=timeout, http2=http2)
+
+async def fetch_page(client: httpx.AsyncClient, url: str, headers: dict = None, params: dict= None,
+                     scheduler: CrawlScheduler = None, cache: ResponseCache = None, fetcher: Fetcher = None):
+    if scheduler is not None:
+        get = functools.partial(scheduler.fetch, client)
+    else:
+        get = client.get
+    if fetcher is not None:
+        # Retries go back through the scheduler, so each attempt is paced like a new request
+        get = functools.partial(fetcher.async_get, get)
+    start = time.perf_counter()
+    extensions = {'trace': RequestTrace(METRICS)}
+    if cache is not None:
+        response = await async_cached_get(cache, url, get, headers=headers, params=params, extensions=extensions)
+    else:
+        response = await get(url, headers=headers, params=params, extensions=extensions)
+    record_response(METRICS, response, time.perf_counter() - start)
+    return response
     
-async def fetch_page_1(url: str, headers: dict = None, cookies: dict= None, retries: int = 3, delay: float = 2.0):
-    for attempt in range(retries):
-        try:
-            async with httpx.AsyncClient(cookies=cookies, timeout=httpx.Timeout(10.0, read=30.0)) as client:
-                return await client.get(url=url, headers=headers, cookies=cookies)
-        except httpx.ReadTimeout:
-            print(f"Timeout encountered. Retrying ({attempt + 1}/{retries}) after {delay} seconds...")
-            await asyncio.sleep(delay)
-    print("Failed to fetch the page after retries. Handling failure...")
-
-async def async_getlinks(url, headers, cookies= None, data= None):
-    response = await fetch_page(url, headers=headers, cookies=cookies)
+async def run_parser(executor: ProcessPoolExecutor, func, *args):
+    # Raw bytes go to a worker process and only the extracted result comes back, so parsing
+    # never blocks the event loop; with no executor, parse inline. The timing includes any
+    # wait for a free worker.
+    with METRICS.timer('parse_seconds', page=func.__name__):
+        if executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+async def async_getlinks(client: httpx.AsyncClient, url, headers, data= None, scheduler: CrawlScheduler = None,
+                         cache: ResponseCache = None, parser: str = DEFAULT_BACKEND,
+                         executor: ProcessPoolExecutor = None, fetcher: Fetcher = None):
+    response = await fetch_page(client, url, headers=headers, scheduler=scheduler, cache=cache, fetcher=fetcher)
     if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        content_container = soup.find('div', class_='content-container')
-        table = content_container.find('table')
-        rows = table.findAll('tr')
-        filtered_rows = [row for row in rows if len(row.findAll('td')) >= 4 and contains_adm(row.findAll('td')[3].text)]
-        urls = [cell.find('a')['href'] for row in filtered_rows for cell in row.find_all('td', limit=2) if cell.find('a')]
+        urls = await run_parser(executor, parse_index_links, response.content, contains_adm, parser)
         return urls 
     else:
         print("Failed to fetch the webpage")
 
-async def scrape_pages(link: str, headers: dict, cookies: dict= None, data: dict= None):
-    base_url = "https://sais.health.pa.gov/CommonPOC/Content/PublicWeb/"
-    parsed_url = urlparse(link)
-    # Parse the query parameters from the URL
-    query_params = parse_qs(parsed_url.query)
-    
-    # Extract the 'Facid' value
-    facid = query_params.get('Facid', [None])[0]
+async def discover_endpoints(client: httpx.AsyncClient, urls, headers, scheduler: CrawlScheduler = None,
+                             cache: ResponseCache = None, parser: str = DEFAULT_BACKEND,
+                             executor: ProcessPoolExecutor = None, fetcher: Fetcher = None,
+                             base_url: str = BASE_URL):
+    # Every index page is fetched at once; the endpoints are merged in url order, one per facid
+    pages = await asyncio.gather(*[async_getlinks(client, url, headers, scheduler=scheduler, cache=cache,
+                                                  parser=parser, executor=executor, fetcher=fetcher)
+                                   for url in urls], return_exceptions=True)
+    links = []
+    for url, page_links in zip(urls, pages):
+        if isinstance(page_links, (httpx.HTTPError, CircuitOpenError, SessionError)):
+            print(f"Failed to fetch index {url}: {page_links!r}")
+        elif isinstance(page_links, Exception):
+            raise page_links
+        else:
+            links += page_links or []
+    return dedupe_by_facid(get_endpoints(links, uri=base_url))
+
+async def scrape_pages(client: httpx.AsyncClient, link: str, headers: dict, data: dict= None,
+                       scheduler: CrawlScheduler = None, cache: ResponseCache = None, state: CrawlState = None,
+                       parser: str = DEFAULT_BACKEND, executor: ProcessPoolExecutor = None,
+                       base_url: str = BASE_URL, fetcher: Fetcher = None, journal: RunJournal = None,
+                       survey_filter: SurveyFilter = None, fingerprints: Fingerprints = None):
+    # Extract the facid value; index pages link with Facid= or facid=
+    facid = facid_from_link(link)
     if not facid:
         print("Facid not found in the link.")
         return None
     
     initial_page_url = f"{base_url}{link}"
-    response = await fetch_page(initial_page_url, headers, cookies)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    select_element = soup.find('select', id='SurveyList')
+    response = await fetch_page(client, initial_page_url, headers, scheduler=scheduler, cache=cache, fetcher=fetcher)
+    if response.status_code != 200:
+        print(f"Failed to fetch {initial_page_url}: HTTP {response.status_code}")
+        return None
+    facility_name, options = await run_parser(executor, parse_facility_page, response.content, parser)
     
-    all_survey_data = {}
-    survey_data = []
+    if options is None:
+        # An error or maintenance page served as 200; returning None leaves the facility
+        # unfinished, so --resume, --incremental or a distributed worker tries it again
+        print(f"Couldn't find the survey list dropdown on {initial_page_url}")
+        if cache is not None:
+            cache.discard(initial_page_url)
+        return None
+    facility = Facility(facid, facility_name)
     
-    facility_name_tag = soup.find('font', {'size': '+1'})
-    facility_name = ''
+    tasks = []
+    options = (survey_filter or SurveyFilter()).apply(facid, options, state)
+    if fingerprints is not None:
+        facility.fingerprint = options_fingerprint(facility_name, options)
+        if fingerprints.options_unchanged(facid, facility.fingerprint):
+            METRICS.inc('unchanged_total', page='facility')
+            return facility
+    if state is not None:
+        options = state.new_options(facid, options)
+    if journal is not None:
+        options = journal.new_options(facid, options)
     
-    if facility_name_tag:
-        for content in facility_name_tag.contents:
-            if isinstance(content, NavigableString):
-                facility_name = content.strip()
-                break
-            
-    all_survey_data['facility'] = facility_name       
+    survey_urls = [f"{base_url}ltc-survey.asp?facid={facid}&page=1&name=&SurveyType=H&eventid={eventid}"
+                   for eventid, _ in options]
+    for survey_url in survey_urls:
+        tasks.append(fetch_page(client, survey_url, headers=headers, scheduler=scheduler, cache=cache,
+                                fetcher=fetcher))
     
-    if not select_element:
-        print("Couldn't find the survey list dropdown.")
-        return {'facility': '', 'data': []}
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+    for response in responses:
+        if isinstance(response, Exception) and not isinstance(response, (httpx.HTTPError, CircuitOpenError, SessionError)):
+            raise response
+    # Pages whose body hashes the same as when last written are not parsed or written again
+    body_hashes, unchanged = {}, set()
+    if fingerprints is not None:
+        known_pages = fingerprints.page_hashes(facid)
+        for response, (eventid, _) in zip(responses, options):
+            if not isinstance(response, Exception):
+                body_hashes[eventid] = fingerprint(response.content)
+                if known_pages.get(eventid) == body_hashes[eventid]:
+                    unchanged.add(eventid)
+        if unchanged:
+            METRICS.inc('unchanged_total', len(unchanged), page='survey')
+    fetched = [response for response, (eventid, _) in zip(responses, options)
+               if not isinstance(response, Exception) and eventid not in unchanged]
+    survey_pages = iter(await asyncio.gather(*[run_parser(executor, parse_survey_page, response.content, parser)
+                                               for response in fetched]))
     
-    if select_element:
-        tasks = []
-        options = select_element.find_all('option')
-        options = filter_surveys_by_year(options)
-        
-        for option in options:
-            eventid = option['value']
-            survey_url = f"{base_url}ltc-survey.asp?facid={facid}&page=1&name=&SurveyType=H&eventid={eventid}"
-            tasks.append(fetch_page(survey_url, headers=headers, cookies=cookies))
-        
-        responses = await asyncio.gather(*tasks)
-        
-        for response, option in zip(responses, options):
-            eventid = option['value']
-            date_txt = option.text.strip()
-            survey_details = {'eventid': eventid, 'date': date_txt}
-            
-            if response is not None:
-                soup = BeautifulSoup(response.content, 'html.parser')
-                tables = soup.findAll('table')
-            
-            if len(tables) >= 5:
-                data_tables = tables[5:-1]
-                survey_details['data'] = ' '.join([table.text.strip() for table in data_tables])            
-            survey_data.append(survey_details)
-        all_survey_data['data'] = survey_data
-        
-        return all_survey_data  
+    for response, survey_url, (eventid, date_txt) in zip(responses, survey_urls, options):
+        if isinstance(response, Exception):
+            # Left without data, so --incremental or --replay picks it up again
+            print(f"Failed to fetch eventid {eventid}: {response!r}")
+            facility.surveys.append(Survey(eventid, date_txt))
+            continue
+        if eventid in unchanged:
+            continue
+        survey_text, deficiencies = next(survey_pages)
+        if survey_text is None and cache is not None:
+            # No survey layout (an error or maintenance page served as 200): not kept in the cache
+            cache.discard(survey_url)
+        facility.surveys.append(Survey(eventid, date_txt, survey_text, deficiencies,
+                                       fingerprint=body_hashes.get(eventid)))
+    
+    return facility
+
+def write_result(link, result: Facility, state: CrawlState = None, store=None, search_index: SearchIndex = None,
+                 journal: RunJournal = None, fingerprints: Fingerprints = None):
+    if result is None:
+        print(f"No data to save for link: {link}")
+        return
+    # An incremental run, or one skipping unchanged pages, with nothing new for this facility
+    # has nothing to write
+    if (state is None and fingerprints is None) or result.surveys:
+        with METRICS.timer('write_seconds', sink=type(store).__name__ if store is not None else 'json'):
+            if store is not None:
+                store.write(facid_from_link(link), result)
+            else:
+                save_json(result)
+        METRICS.inc('facilities_written_total')
+        METRICS.inc('surveys_written_total', len(result.surveys))
+        if search_index is not None:
+            search_index.write(facid_from_link(link), result)
+        if state is not None:
+            state.mark_scraped(facid_from_link(link), result.surveys)
+    if fingerprints is not None:
+        fingerprints.mark_written(facid_from_link(link), result)
+    if journal is not None:
+        journal.mark_done(facid_from_link(link), result.surveys)
+
+async def crawl(client: httpx.AsyncClient, endpoints, headers: dict, data: dict = None,
+                scheduler: CrawlScheduler = None, cache: ResponseCache = None, state: CrawlState = None,
+                parser: str = DEFAULT_BACKEND, executor: ProcessPoolExecutor = None, store=None,
+                search_index: SearchIndex = None, facility_workers: int = 8, queue_size: int = 16,
+                base_url: str = BASE_URL, fetcher: Fetcher = None, journal: RunJournal = None,
+                survey_filter: SurveyFilter = None, fingerprints: Fingerprints = None):
+    # discover -> scrape (facility page, its surveys, parse) -> write, joined by bounded queues.
+    # Each facility is written as soon as it finishes and at most facility_workers + queue_size
+    # facilities are held in memory, however long the endpoint list is.
+    link_queue = asyncio.Queue(maxsize=queue_size)
+    result_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def discover():
+        for link in endpoints:
+            await link_queue.put(link)
+        for _ in range(facility_workers):
+            await link_queue.put(None)
+
+    async def scrape_worker():
+        while True:
+            link = await link_queue.get()
+            METRICS.set('queue_depth', link_queue.qsize(), queue='links')
+            if link is None:
+                break
+            try:
+                result = await scrape_pages(client, link, headers, data, scheduler=scheduler, cache=cache,
+                                            state=state, parser=parser, executor=executor,
+                                            base_url=base_url, fetcher=fetcher, journal=journal,
+                                            survey_filter=survey_filter, fingerprints=fingerprints)
+            except (httpx.HTTPError, CircuitOpenError, SessionError) as e:
+                print(f"Failed to scrape {link}: {e!r}")
+                result = None
+            await result_queue.put((link, result))
+        await result_queue.put(None)
+
+    async def writer():
+        finished_workers = 0
+        while finished_workers < facility_workers:
+            item = await result_queue.get()
+            METRICS.set('queue_depth', result_queue.qsize(), queue='results')
+            if item is None:
+                finished_workers += 1
+                continue
+            link, result = item
+            write_result(link, result, state, store, search_index, journal, fingerprints)
 
-async def main():
-    daac_url = "https://apps.health.pa.gov/surveyspostedDAAC/DAAC-SurveysPosted_202402.aspx"
+    await asyncio.gather(discover(), writer(), *[scrape_worker() for _ in range(facility_workers)])
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scrape PA DOH facility surveys concurrently.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch and save eventids not already recorded in the state store')
+    parser.add_argument('--state', default='./state.sqlite', help='state store used by --incremental')
+    parser.add_argument('--fingerprints', help='skip facilities and survey pages unchanged since they were last '
+                                               'written, keeping content hashes in this SQLite file')
+    add_filter_args(parser)
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=BACKENDS, help='HTML parsing backend')
+    parser.add_argument('--no-cache', action='store_true', help='fetch every page from the site, without ./cache')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count(),
+                        help='processes used for HTML parsing (0 parses on the event loop)')
+    parser.add_argument('--sink', default='json', choices=SINKS,
+                        help='json: one file per facility; jsonl/sqlite: one consolidated store, upserted by (facid, eventid)')
+    parser.add_argument('--output', help='path of the jsonl/sqlite store')
+    parser.add_argument('--index', help='also add saved surveys to this full-text search index (see search.py)')
+    parser.add_argument('--facility-workers', type=int, default=8,
+                        help='facilities scraped concurrently by the crawl pipeline')
+    parser.add_argument('--retries', type=int, default=4, help='attempts per page before it is dead-lettered')
+    parser.add_argument('--dead-letters', default='./dead_letters.jsonl', help='where pages that kept failing are listed')
+    parser.add_argument('--replay', action='store_true',
+                        help='scrape the facilities listed in --dead-letters instead of the DAAC index')
+    parser.add_argument('--months', help='DAAC index months to read, YYYYMM or YYYYMM:YYYYMM (default: 202402)')
+    parser.add_argument('--daac-url', action='append', help='another posted-surveys list to read (repeatable)')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port while running')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='address the metrics port listens on (0.0.0.0: every interface)')
+    parser.add_argument('--metrics-json', help='write a JSON metrics snapshot to this file every --metrics-interval')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='seconds between JSON snapshots')
+    parser.add_argument('--landing-url', action='append', default=[],
+                        help='page a new site session starts from, per host (default: the site root)')
+    parser.add_argument('--journal', default='./run_journal.json', help='progress journal written during every run')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the unfinished run in --journal instead of starting over')
+    args = parser.parse_args()
+    check_backend(args.parser)
+    # The last scrape of each facility is read from the state store
+    args.incremental = args.incremental or args.since_last_scrape
+    return args
+
+async def main(args):
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
         'Accept-Encoding': 'gzip, deflate, br, zstd',
         'Accept-Language': 'en-US,en;q=0.9',
         'Cache-Control': 'max-age=0',
         'Connection': 'keep-alive',
-        'Cookie': 'paGov=1; _ga_43SYEQBLV4=GS1.1.1701298993.1.1.1701299170.0.0.0; _ga_Y97KNG0WT3=GS1.1.1702655416.2.0.1702655416.0.0.0; _ga_EFBFYET3JS=GS1.1.1705532227.1.1.1705532239.0.0.0; visid_incap_2815744=xjCHti1DRE+C+DecvMgYa1NbqGUAAAAAQUIPAAAAAABnHMKnuYDw6XcK4WUnuxn1; _ga_5ETEHW2RE7=GS1.1.1705532245.1.0.1705532250.0.0.0; _ga_45SCT2E2LM=GS1.2.1710243958.6.0.1710243958.60.0.0; _ga_EVYRH4J3SP=GS1.1.1710697627.53.0.1710697627.0.0.0; visid_incap_2815840=dIL4Z5f4SA2OLlZEESUVbHiY+2UAAAAAQUIPAAAAAACa4Yx08pP2Dn9SnkPOs+Sv; _gcl_au=1.1.1914906969.1710987387; _ga=GA1.3.308807853.1701298993; _ga=GA1.4.308807853.1701298993; ASP.NET_SessionId=mdyats4fzai1yqbfph4iwb3j; _gid=GA1.2.821789585.1711105720; _ga_J4ZD36GZ4Z=GS1.2.1711105720.55.0.1711105720.60.0.0; _ga=GA1.1.308807853.1701298993; _ga_P7HXBG8L73=GS1.1.1711109996.57.0.1711109996.0.0.0; _ga_BB0F8LZZJ6=GS1.1.1711109996.2.0.1711109996.60.0.443245163; _gid=GA1.4.821789585.1711105720; _gat_UA-41550633-37=1; incap_ses_1340_2815840=qblKVFQBoyJOP6ZQ66OYEmt3/WUAAAAA9FOyfr457I8JGWJo7W5nQw==',
         'Host': 'apps.health.pa.gov',
         'Sec-Fetch-Dest': 'document',
         'Sec-Fetch-Mode': 'navigate',
@@ -162,56 +333,61 @@ async def main():
         'sec-ch-ua-mobile': '?0',
         'sec-ch-ua-platform': '"Windows"'
     }
-    cookies = {
-        '_ga_43SYEQBLV4': 'GS1.1.1701298993.1.1.1701299170.0.0.0',
-        '_ga_Y97KNG0WT3': 'GS1.1.1702655416.2.0.1702655416.0.0.0',
-        '_ga_EFBFYET3JS': 'GS1.1.1705532227.1.1.1705532239.0.0.0',
-        'visid_incap_2815744': 'xjCHti1DRE+C+DecvMgYa1NbqGUAAAAAQUIPAAAAAABnHMKnuYDw6XcK4WUnuxn1',
-        '_ga_5ETEHW2RE7': 'GS1.1.1705532245.1.0.1705532250.0.0.0',
-        '_ga_45SCT2E2LM': 'GS1.2.1710243958.6.0.1710243958.60.0.0',
-        '_ga_EVYRH4J3SP': 'GS1.1.1710697627.53.0.1710697627.0.0.0',
-        '_ga_P7HXBG8L73': 'GS1.1.1710697627.55.0.1710697627.0.0.0',
-        '_ga': 'GA1.2.308807853.1701298993',
-        'ASP.NET_SessionId': 'oi0sjzi5oclme01dztvbmda0',
-        '_gid': 'GA1.2.2087917036.1710934762',
-        '_ga_J4ZD36GZ4Z': 'GS1.2.1710934762.53.0.1710934762.60.0.0',
-        'ASPSESSIONIDSGCSTSCC': 'PBIMPPOAMDCLMMKCAGDCMGJD',
-        'cookiesession1': '678B289230A0F4DA773BAF428CBD4812',
-    }   
-    params = {
-        'csrf_token': '{07802E4E-E746-4A43-A339-978640700D82}',
-    }
-    testpoints = [
-        'ltc-survey.asp?Facid=750301&PAGE=1&SurveyType=H', 'ltc-survey.asp?Facid=27171500&PAGE=1&SurveyType=H', 
-        'ltc-survey.asp?Facid=061901&PAGE=1&SurveyType=H', 'ltc-survey.asp?Facid=195601&PAGE=1&SurveyType=H', 
-        'ltc-survey.asp?Facid=120801&PAGE=1&SurveyType=H', 'ltc-survey.asp?Facid=22701501&PAGE=1&SurveyType=H', 
-        'ltc-survey.asp?Facid=53020100&PAGE=1&SurveyType=H', 'ltc-survey.asp?Facid=24230101&PAGE=1&SurveyType=H'
-    ]
-    
-    links = await async_getlinks(daac_url, headers=headers)
-    unique_list = list(set(links))
-    endpoints = get_endpoints(unique_list)
     
-    #tasks = [scrape_pages(url, headers, cookies) for url in endpoints]  # Prepare coroutine list
-    #results = await asyncio.gather(*tasks)  # Run concurrently
-    
-    batch_size = 10  # Number of concurrent requests
-    delay_between_batches = 15  # Seconds
-
-    for i in range(0, len(endpoints), batch_size):
-        batch = endpoints[i:i+batch_size]
-        tasks = [scrape_pages(url, headers, cookies, params) for url in endpoints]  # Prepare coroutine list
-        results = await asyncio.gather(*tasks)
-        save_json(results)
-        await asyncio.sleep(delay_between_batches)  # Delay before the next batch
-    
-    # Save results to JSON files
-    #for result in results:
-        #save_json(result)
+    # The scheduler replaces fixed batches + sleeps: it caps in-flight requests, rate limits
+    # per host and backs off on 429/5xx/timeouts, growing again once responses are healthy
+    scheduler = CrawlScheduler(max_in_flight=32, initial_concurrency=8, rate_per_host=4.0)
+    cache = None if args.no_cache else ResponseCache('./cache')
+    state = CrawlState(args.state) if args.incremental else None
+    store = open_store(args.sink, args.output)
+    search_index = SearchIndex(args.index) if args.index else None
+    fingerprints = Fingerprints(args.fingerprints) if args.fingerprints else None
+    executor = ProcessPoolExecutor(max_workers=args.parse_workers) if args.parse_workers > 0 else None
+    exporter = MetricsExporter(METRICS, args.metrics_port, args.metrics_json, args.metrics_interval,
+                               args.metrics_host).start()
+    replayed = DeadLetters.load(args.dead_letters) if args.replay else None
+    journal = RunJournal.load(args.journal) if args.resume else None
+    async with create_client() as client:
+        # The manager starts the site session in the client's cookie jar and restarts it on expiry
+        fetcher = Fetcher(attempts=args.retries, dead_letters=DeadLetters(args.dead_letters),
+                          session=SessionManager(client.cookies, landing_urls(args.landing_url)))
+        if journal is not None and journal.resumable():
+            endpoints = journal.remaining()
+            print(f'Resuming run: {len(endpoints)} of {len(journal.endpoints)} facilities left')
+        else:
+            if replayed is not None:
+                endpoints = replay_endpoints(replayed)
+            else:
+                endpoints = await discover_endpoints(client, daac_urls(args.months, args.daac_url, DAAC_URL), headers,
+                                                     scheduler=scheduler, cache=cache, parser=args.parser,
+                                                     executor=executor, fetcher=fetcher)
+            journal = RunJournal(args.journal)
+            journal.start(endpoints)
+        
+        await crawl(client, endpoints, headers, None, scheduler=scheduler, cache=cache, state=state,
+                    parser=args.parser, executor=executor, store=store,
+                    search_index=search_index, facility_workers=args.facility_workers, fetcher=fetcher,
+                    journal=journal, survey_filter=SurveyFilter.from_args(args), fingerprints=fingerprints)
+    journal.finish()
+    if cache is not None:
+        cache.close()
+    fetcher.dead_letters.close()
+    if executor is not None:
+        executor.shutdown()
+    if state is not None:
+        state.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    if store is not None:
+        store.close()
+    if search_index is not None:
+        search_index.close()
+    exporter.close()
+    print(METRICS.summary())
     
 if __name__ == "__main__":
     start_time = time.time()  # record the start time
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
     end_time = time.time()  # record the end time
     total_time = end_time - start_time  # calculate the execution time
     print(f"Total execution time: {total_time} seconds")  
\ No newline at end of file